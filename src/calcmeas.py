@@ -17,8 +17,46 @@ History:
 '''
 
 import sys
+import os
+import time
 import re
-from prettytable import PrettyTable
+import math
+import json
+import itertools
+import mmap
+import zlib
+import bz2
+from array import array
+from collections import deque
+from optparse import OptionParser
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# the modules not needed by every run (prettytable, numpy, sqlite3, multiprocessing, ...) are imported by the
+# functions using them, so the small runs, e.g. 'calcmeas.py hosts --host 0-0-1 <measlog>', start faster.
+optional_modules = {}
+
+
+def get_optional_module(*names):
+    '''import the first installed module of names when it is used for the first time, e.g.
+    get_optional_module('lzma', 'backports.lzma'). return None if none of them is installed.
+    '''
+    
+    if names not in optional_modules:
+        optional_modules[names] = None
+        for name in names:
+            try:
+                __import__(name)
+            except ImportError:
+                continue
+            optional_modules[names] = sys.modules[name]
+            break
+    
+    return optional_modules[names]
 
 
 host_role_definition = {'pilot' : ('0-0-1', '0-0-9'),
@@ -28,132 +66,1493 @@ host_role_definition = {'pilot' : ('0-0-1', '0-0-9'),
                     }
 
 
-SA_SPAMEAS_infolist = []
-MS_PROCESS_MEAS_infolist = []
-MS_PERF_MEAS_infolist = []
+class HostTopology(object):
+    '''this class compiles the role definition (role -> host_ids) into integer codes:
+    1. roles: the role names, the code of a role is its index. code 0 (role None) is for the hosts without a role.
+    2. host_role_codes: host_id -> role code
+    so the role of a host is found by one dict lookup, and the rows are grouped by indexing a list with the code.
+    '''
+    
+    def __init__(self, role_definition):
+        self.roles = [None] + sorted(role_definition.keys())
+        self.role_codes = dict([(self.roles[code], code) for code in range(len(self.roles))])
+        self.host_role_codes = {}
+        for role, host_ids in role_definition.items():
+            for host_id in host_ids:
+                if host_id in self.host_role_codes and self.host_role_codes[host_id] != self.role_codes[role]:
+                    raise ValueError('host %s has two roles: %s and %s' % (host_id, self.roles[self.host_role_codes[host_id]], role))
+                self.host_role_codes[host_id] = self.role_codes[role]
+    
+    def get_role_code(self, host_id):
+        return self.host_role_codes.get(host_id, 0)
+    
+    def get_role(self, host_id):
+        return self.roles[self.host_role_codes.get(host_id, 0)]
+    
+    def get_role_groups(self, role_groups, default_group):
+        '''return the group of each role code, role_groups maps role -> group, the other roles go to default_group.'''
+        
+        return [role_groups.get(role, default_group) for role in self.roles]
+
+
+host_topology = HostTopology(host_role_definition)
+
+
+def expand_host_ids(value):
+    '''expand the host ids in a topology file, separated by ',' or spaces. each field of a host id may be
+    a range 'first..last', e.g. '0-0..3-1..16' is the blades 1 - 16 of the frames 0 - 3 in shelf 0.
+    '''
+    
+    host_ids = []
+    for item in value.replace(',', ' ').split():
+        fields = []
+        for field in item.split('-'):
+            if '..' in field:
+                first, last = field.split('..', 1)
+                if not first.isdigit() or not last.isdigit() or int(first) > int(last):
+                    raise ValueError('wrong range %s in host id %s' % (field, item))
+                fields.append([str(number) for number in range(int(first), int(last) + 1)])
+            else:
+                fields.append([field])
+        for host_fields in itertools.product(*fields):
+            host_ids.append('-'.join(host_fields))
+    
+    return host_ids
+
+
+def load_host_topology(path):
+    '''load the role definition from the [roles] section of the topology file, e.g.
+        [roles]
+        pilot = 0-0-1, 0-0-9
+        db2 = 0-0-3, 0-0-11, 0-1..2-2..3
+    then compile it into host_topology. host_role_definition is replaced by the loaded one.
+    raise ValueError if the file is wrong.
+    '''
+    
+    global host_role_definition, host_topology
+    
+    import ConfigParser
+    config = ConfigParser.RawConfigParser()
+    config.optionxform = str
+    try:
+        if not config.read([path]):
+            raise ValueError('failed to read topology file %s' % path)
+        role_definition = {}
+        for role, value in config.items('roles'):
+            role_definition[role] = tuple(expand_host_ids(value))
+    except ConfigParser.Error, e:
+        raise ValueError('wrong topology file %s: %s' % (path, e))
+    if 'app' in role_definition:
+        raise ValueError("role app is reserved for the hosts without a role")
+    
+    topology = HostTopology(role_definition)
+    host_role_definition, host_topology = role_definition, topology
 
 
-def get_block_info(measlog, num):
-    '''this function receives measlog content and the current offset, return:
-    1. (begin, end) offsets of the message block. format: (int, int)
-    2. the report time of the message block. format: 'YYYY-MM-DD hh:mm'
-    3*. the message id of the message block.
-    *: not implemented. 
+class MeasStore(object):
+    '''this class keeps the information of the analyzed tables, indexed by report_time:
+    1. spa_meas: report_time -> [(spa_name, tps), ...]
+    2. process_meas: report_time -> [(host_id, role code, cpu_usage), ...]
+       process_index: report_time -> {process_name: [offset in process_meas[report_time], ...]}
+    3. perf_meas: report_time -> {host_id: overall_cpu_usage}
+    the report times of each table and the rows of each report time are kept in the order they appear in
+    the measlog, so the sums are calculated in the same order as before.
+    role code is looked up from host_topology when the row is saved, 0 for the hosts without a role.
     '''
     
-    # get (begin, end) offsets    
-    begin = end = num
-    while re.search(r'\+\+\+', measlog[begin]) is None:
-        begin -= 1
-    while re.search(r'\+\+\-', measlog[end]) is None:
-        end += 1
+    def __init__(self):
+        self.spa_report_times = []
+        self.spa_meas = {}
+        self.process_report_times = []
+        self.process_meas = {}
+        self.process_index = {}
+        self.perf_report_times = []
+        self.perf_meas = {}
+    
+    def add_spa_meas(self, report_time, spa_name, tps):
+        if report_time not in self.spa_meas:
+            self.spa_report_times.append(report_time)
+            self.spa_meas[report_time] = []
+        self.spa_meas[report_time].append((spa_name, tps))
+    
+    def add_process_meas(self, report_time, host_id, process_name, cpu_usage):
+        if report_time not in self.process_meas:
+            self.process_report_times.append(report_time)
+            self.process_meas[report_time] = []
+            self.process_index[report_time] = {}
+        process_meas = self.process_meas[report_time]
+        process_index = self.process_index[report_time]
+        if process_name not in process_index:
+            process_index[process_name] = []
+        process_index[process_name].append(len(process_meas))
+        process_meas.append((host_id, host_topology.get_role_code(host_id), float(cpu_usage)))
+    
+    def add_perf_meas(self, report_time, host_id, overall_cpu_usage):
+        if report_time not in self.perf_meas:
+            self.perf_report_times.append(report_time)
+            self.perf_meas[report_time] = {}
+        self.perf_meas[report_time][host_id] = overall_cpu_usage
+    
+    def add_block(self, table_name, report_time, rows):
+        '''save the rows of a block returned by iter_measlog_blocks().'''
+        
+        if table_name == 'SA_SPAMEAS':
+            for item in rows:
+                self.add_spa_meas(report_time, item['spa_name'], item['tps'])
+        elif table_name == 'MS_PROCESS_MEAS':
+            for item in rows:
+                self.add_process_meas(report_time, item['host_id'], item['process_name'], item['cpu_usage'])
+        elif table_name == 'MS_PERF_MEAS':
+            for item in rows:
+                self.add_perf_meas(report_time, item['host_id'], item['overall_cpu_usage'])
+    
+    def get_spa_meas(self):
+        '''return [(report_time, spa_name, tps), ...] of SA_SPAMEAS table.'''
+        
+        spa_meas = []
+        for report_time in self.spa_report_times:
+            for spa_name, tps in self.spa_meas[report_time]:
+                spa_meas.append((report_time, spa_name, tps))
+        
+        return spa_meas
+    
+    def iter_process_meas(self):
+        '''yield (report_time, host_id, process_name, cpu_usage) of MS_PROCESS_MEAS table.'''
+        
+        for report_time in self.process_report_times:
+            process_meas = self.process_meas[report_time]
+            for process_name, offsets in self.process_index[report_time].iteritems():
+                for offset in offsets:
+                    host_id, role_code, cpu_usage = process_meas[offset]
+                    yield (report_time, host_id, process_name, cpu_usage)
+    
+    def iter_perf_meas(self):
+        '''yield (report_time, host_id, overall_cpu_usage) of MS_PERF_MEAS table.'''
+        
+        for report_time in self.perf_report_times:
+            for host_id, overall_cpu_usage in self.perf_meas[report_time].iteritems():
+                yield (report_time, host_id, overall_cpu_usage)
+    
+    def get_process_report_times(self):
+        return list(self.process_report_times)
+    
+    def get_perf_report_times(self):
+        return list(self.perf_report_times)
+    
+    def drop_before(self, report_time):
+        '''drop the measurements reported before report_time, it keeps the store of a long running process bounded.'''
+        
+        for report_times, tables in ((self.spa_report_times, (self.spa_meas,)),
+                                     (self.process_report_times, (self.process_meas, self.process_index)),
+                                     (self.perf_report_times, (self.perf_meas,))):
+            kept_report_times = []
+            for item_report_time in report_times:
+                if item_report_time < report_time:
+                    for table in tables:
+                        del table[item_report_time]
+                else:
+                    kept_report_times.append(item_report_time)
+            report_times[:] = kept_report_times
+    
+    def get_row_counts(self):
+        '''return {table_name: number of rows} of the saved tables.'''
+        
+        row_counts = {'SA_SPAMEAS' : 0, 'MS_PROCESS_MEAS' : 0, 'MS_PERF_MEAS' : 0}
+        for table_name, meas in (('SA_SPAMEAS', self.spa_meas), ('MS_PROCESS_MEAS', self.process_meas), ('MS_PERF_MEAS', self.perf_meas)):
+            for rows in meas.values():
+                row_counts[table_name] += len(rows)
+        
+        return row_counts
+    
+    def aggregate_process_cpu(self, is_matched, role_groups, default_group, report_times = None):
+        '''sum up the cpu usage of the processes accepted by is_matched(process_name) for each report time.
+        the rows are grouped by the role of the host: role_groups maps role -> group, the hosts of other roles
+        go to default_group. only the specified report times are calculated if report_times is given.
+        return {report_time: {group: [count, sum]}}
+        '''
+        
+        return self.aggregate_processes_cpu([is_matched], role_groups, default_group, report_times)[0]
+    
+    def aggregate_processes_cpu(self, matchers, role_groups, default_group, report_times = None):
+        '''the same as aggregate_process_cpu(), but for a list of matchers in a single pass: each process name
+        is matched against all the matchers only once, and only the matched rows of each matcher are summed up.
+        return [{report_time: {group: [count, sum]}}, ...] in the order of matchers
+        '''
+        
+        # the indexes of the matchers accepting each process name, and the group of each role code
+        name_matchers = {}
+        role_code_groups = host_topology.get_role_groups(role_groups, default_group)
+        
+        if report_times is None:
+            report_times = self.process_report_times
+        
+        processes_cpu = [{} for matcher in matchers]
+        for report_time in report_times:
+            if report_time not in self.process_index:
+                continue
+            
+            # collect the rows of each matcher
+            matcher_offsets = [[] for matcher in matchers]
+            for process_name, process_offsets in self.process_index[report_time].iteritems():
+                indexes = name_matchers.get(process_name)
+                if indexes is None:
+                    indexes = name_matchers[process_name] = [index for index in xrange(len(matchers)) if matchers[index](process_name)]
+                for index in indexes:
+                    matcher_offsets[index].extend(process_offsets)
+            
+            process_meas = self.process_meas[report_time]
+            for index in xrange(len(matchers)):
+                # keep the rows in the order of measlog
+                offsets = matcher_offsets[index]
+                offsets.sort()
+                
+                groups = {}
+                for offset in offsets:
+                    host_id, role_code, cpu_usage = process_meas[offset]
+                    group = role_code_groups[role_code]
+                    if group not in groups:
+                        groups[group] = [0, 0]
+                    groups[group][0] += 1
+                    groups[group][1] += cpu_usage
+                
+                processes_cpu[index][report_time] = groups
+        
+        return processes_cpu
+    
+    def add_columns(self, columns):
+        '''save the rows of a ColumnarMeasStore, e.g. the one loaded from the parsed cache.'''
+        
+        report_times, host_ids, names = columns.report_times, columns.host_ids, columns.names
+        
+        for index in xrange(len(columns.spa_time)):
+            self.add_spa_meas(report_times[columns.spa_time[index]], names[columns.spa_name[index]], columns.spa_tps[index])
+        for index in xrange(len(columns.process_time)):
+            self.add_process_meas(report_times[columns.process_time[index]], host_ids[columns.process_host[index]],
+                                  names[columns.process_name[index]], columns.process_cpu[index])
+        for index in xrange(len(columns.perf_time)):
+            self.add_perf_meas(report_times[columns.perf_time[index]], host_ids[columns.perf_host[index]], columns.perf_cpu[index])
+    
+    def aggregate_overall_cpu(self, host_ids, report_times = None):
+        '''return {report_time: {host_id: overall_cpu_usage}} of the specified hosts.
+        only the specified report times are returned if report_times is given.
+        '''
+        
+        if report_times is None:
+            report_times = self.perf_report_times
+        
+        overall_cpu = {}
+        for report_time in report_times:
+            if report_time not in self.perf_meas:
+                continue
+            perf_meas = self.perf_meas[report_time]
+            overall_cpu[report_time] = {}
+            for host_id in host_ids:
+                if host_id in perf_meas:
+                    overall_cpu[report_time][host_id] = perf_meas[host_id]
+        
+        return overall_cpu
+
+
+class ColumnarMeasStore(MeasStore):
+    '''this class keeps the same information as MeasStore, but each table is saved as typed arrays:
+    1. SA_SPAMEAS: spa_time, spa_name, spa_tps
+    2. MS_PROCESS_MEAS: process_time, process_host, process_name, process_cpu
+    3. MS_PERF_MEAS: perf_time, perf_host, perf_cpu
+    report times, host ids and spa/process names are interned, the arrays hold their codes.
+    when numpy is available the KPIs are calculated as vectorized group-by operations over the arrays.
+    note the cpu usage is float32 by default, the averages may differ from MeasStore in the last digit.
+    '''
+    
+    # (name, typecode) of the arrays, 'cpu' is replaced by the typecode of process_cpu
+    columns = (('spa_time', 'i'), ('spa_name', 'i'), ('spa_tps', 'i'),
+               ('process_time', 'i'), ('process_host', 'i'), ('process_name', 'i'), ('process_cpu', 'cpu'),
+               ('perf_time', 'i'), ('perf_host', 'i'), ('perf_cpu', 'i'))
+    
+    def __init__(self, cpu_typecode = 'f'):
+        self.cpu_typecode = cpu_typecode
+        self.report_times = []
+        self.report_time_codes = {}
+        self.host_ids = []
+        self.host_codes = {}
+        self.names = []
+        self.name_codes = {}
+        
+        self.spa_time = array('i')
+        self.spa_name = array('i')
+        self.spa_tps = array('i')
+        self.process_time = array('i')
+        self.process_host = array('i')
+        self.process_name = array('i')
+        self.process_cpu = array(cpu_typecode)
+        self.perf_time = array('i')
+        self.perf_host = array('i')
+        self.perf_cpu = array('i')
+        
+        # report times of each table in the order of measlog
+        self.process_report_times = []
+        self.process_time_seen = {}
+        self.perf_report_times = []
+        self.perf_time_seen = {}
+    
+    def intern(self, value, values, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+    
+    def add_spa_meas(self, report_time, spa_name, tps):
+        self.spa_time.append(self.intern(report_time, self.report_times, self.report_time_codes))
+        self.spa_name.append(self.intern(spa_name, self.names, self.name_codes))
+        self.spa_tps.append(tps)
+    
+    def add_process_meas(self, report_time, host_id, process_name, cpu_usage):
+        time_code = self.intern(report_time, self.report_times, self.report_time_codes)
+        if time_code not in self.process_time_seen:
+            self.process_time_seen[time_code] = True
+            self.process_report_times.append(report_time)
+        self.process_time.append(time_code)
+        self.process_host.append(self.intern(host_id, self.host_ids, self.host_codes))
+        self.process_name.append(self.intern(process_name, self.names, self.name_codes))
+        self.process_cpu.append(float(cpu_usage))
+    
+    def add_perf_meas(self, report_time, host_id, overall_cpu_usage):
+        time_code = self.intern(report_time, self.report_times, self.report_time_codes)
+        if time_code not in self.perf_time_seen:
+            self.perf_time_seen[time_code] = True
+            self.perf_report_times.append(report_time)
+        self.perf_time.append(time_code)
+        self.perf_host.append(self.intern(host_id, self.host_ids, self.host_codes))
+        self.perf_cpu.append(overall_cpu_usage)
+    
+    def add_columns(self, columns):
+        
+        # translate the codes of columns into the codes of this store
+        time_codes = [self.intern(report_time, self.report_times, self.report_time_codes) for report_time in columns.report_times]
+        host_codes = [self.intern(host_id, self.host_ids, self.host_codes) for host_id in columns.host_ids]
+        name_codes = [self.intern(name, self.names, self.name_codes) for name in columns.names]
+        
+        for report_time in columns.process_report_times:
+            if self.report_time_codes[report_time] not in self.process_time_seen:
+                self.process_time_seen[self.report_time_codes[report_time]] = True
+                self.process_report_times.append(report_time)
+        for report_time in columns.perf_report_times:
+            if self.report_time_codes[report_time] not in self.perf_time_seen:
+                self.perf_time_seen[self.report_time_codes[report_time]] = True
+                self.perf_report_times.append(report_time)
+        
+        self.spa_time.extend(array('i', [time_codes[code] for code in columns.spa_time]))
+        self.spa_name.extend(array('i', [name_codes[code] for code in columns.spa_name]))
+        self.spa_tps.extend(columns.spa_tps)
+        self.process_time.extend(array('i', [time_codes[code] for code in columns.process_time]))
+        self.process_host.extend(array('i', [host_codes[code] for code in columns.process_host]))
+        self.process_name.extend(array('i', [name_codes[code] for code in columns.process_name]))
+        self.process_cpu.extend(array(self.cpu_typecode, columns.process_cpu))
+        self.perf_time.extend(array('i', [time_codes[code] for code in columns.perf_time]))
+        self.perf_host.extend(array('i', [host_codes[code] for code in columns.perf_host]))
+        self.perf_cpu.extend(columns.perf_cpu)
+    
+    def get_filtered(self, meas_filter):
+        '''return a new ColumnarMeasStore with the rows accepted by meas_filter.'''
+        
+        store = ColumnarMeasStore(self.cpu_typecode)
+        
+        # check each report time and host only once
+        time_accepted = [meas_filter.accept_time(report_time) for report_time in self.report_times]
+        host_accepted = [meas_filter.accept_host(host_id) for host_id in self.host_ids]
+        
+        if meas_filter.accept_table('SA_SPAMEAS'):
+            for index in xrange(len(self.spa_time)):
+                if time_accepted[self.spa_time[index]]:
+                    store.add_spa_meas(self.report_times[self.spa_time[index]], self.names[self.spa_name[index]], self.spa_tps[index])
+        if meas_filter.accept_table('MS_PROCESS_MEAS'):
+            for index in xrange(len(self.process_time)):
+                if time_accepted[self.process_time[index]] and host_accepted[self.process_host[index]]:
+                    store.add_process_meas(self.report_times[self.process_time[index]], self.host_ids[self.process_host[index]],
+                                           self.names[self.process_name[index]], self.process_cpu[index])
+        if meas_filter.accept_table('MS_PERF_MEAS'):
+            for index in xrange(len(self.perf_time)):
+                if time_accepted[self.perf_time[index]] and host_accepted[self.perf_host[index]]:
+                    store.add_perf_meas(self.report_times[self.perf_time[index]], self.host_ids[self.perf_host[index]], self.perf_cpu[index])
+        
+        return store
+    
+    def drop_before(self, report_time):
+        '''the same as MeasStore.drop_before(), the arrays are rebuilt with the measurements kept.'''
+        
+        self.__dict__.update(self.get_filtered(MeasFilter(time_from = report_time)).__dict__)
+    
+    def get_spa_meas(self):
+        spa_meas = []
+        for index in xrange(len(self.spa_time)):
+            spa_meas.append((self.report_times[self.spa_time[index]], self.names[self.spa_name[index]], self.spa_tps[index]))
+        
+        return spa_meas
+    
+    def iter_process_meas(self):
+        for index in xrange(len(self.process_time)):
+            yield (self.report_times[self.process_time[index]], self.host_ids[self.process_host[index]],
+                   self.names[self.process_name[index]], self.process_cpu[index])
+    
+    def iter_perf_meas(self):
+        for index in xrange(len(self.perf_time)):
+            yield (self.report_times[self.perf_time[index]], self.host_ids[self.perf_host[index]], self.perf_cpu[index])
+    
+    def get_row_counts(self):
+        return {'SA_SPAMEAS' : len(self.spa_time), 'MS_PROCESS_MEAS' : len(self.process_time), 'MS_PERF_MEAS' : len(self.perf_time)}
+    
+    def aggregate_processes_cpu(self, matchers, role_groups, default_group, report_times = None):
+        
+        # match each name against the matchers and classify each host only once
+        names_matched = [[bool(is_matched(name)) for name in self.names] for is_matched in matchers]
+        role_code_groups = host_topology.get_role_groups(role_groups, default_group)
+        groups = []
+        host_groups = []
+        for host_id in self.host_ids:
+            group = role_code_groups[host_topology.get_role_code(host_id)]
+            if group not in groups:
+                groups.append(group)
+            host_groups.append(groups.index(group))
+        
+        slot_num = len(self.report_times) * len(groups)
+        counts_list = []
+        sums_list = []
+        numpy = get_optional_module('numpy')
+        if numpy is not None and slot_num:
+            process_time = numpy.frombuffer(self.process_time, dtype=numpy.int32)
+            process_host = numpy.frombuffer(self.process_host, dtype=numpy.int32)
+            process_name = numpy.frombuffer(self.process_name, dtype=numpy.int32)
+            process_cpu = numpy.frombuffer(self.process_cpu, dtype=self.cpu_typecode).astype(numpy.float64)
+            
+            # the (report time, group of host) slot of each row is shared by all the matchers
+            slots = process_time * len(groups) + numpy.array(host_groups, dtype=numpy.int32)[process_host]
+            for name_matched in names_matched:
+                selected = numpy.array(name_matched, dtype=bool)[process_name]
+                counts_list.append(numpy.bincount(slots[selected], minlength=slot_num).tolist())
+                sums_list.append(numpy.bincount(slots[selected], weights=process_cpu[selected], minlength=slot_num).tolist())
+        else:
+            name_matchers = [[index for index in xrange(len(matchers)) if names_matched[index][name_code]] \
+                             for name_code in xrange(len(self.names))]
+            counts_list = [[0] * slot_num for is_matched in matchers]
+            sums_list = [[0.0] * slot_num for is_matched in matchers]
+            for row in xrange(len(self.process_time)):
+                indexes = name_matchers[self.process_name[row]]
+                if indexes:
+                    slot = self.process_time[row] * len(groups) + host_groups[self.process_host[row]]
+                    for index in indexes:
+                        counts_list[index][slot] += 1
+                        sums_list[index][slot] += self.process_cpu[row]
+        
+        if report_times is None:
+            report_times = self.process_report_times
+        
+        # all the report times are calculated by the arrays, only the specified ones are returned
+        processes_cpu = []
+        for counts, sums in zip(counts_list, sums_list):
+            process_cpu = {}
+            for report_time in report_times:
+                if report_time not in self.report_time_codes or self.report_time_codes[report_time] not in self.process_time_seen:
+                    continue
+                base = self.report_time_codes[report_time] * len(groups)
+                process_cpu[report_time] = {}
+                for group_code in xrange(len(groups)):
+                    if counts[base + group_code]:
+                        process_cpu[report_time][groups[group_code]] = [counts[base + group_code], sums[base + group_code]]
+            processes_cpu.append(process_cpu)
+        
+        return processes_cpu
+    
+    def aggregate_overall_cpu(self, host_ids, report_times = None):
+        if report_times is None:
+            report_times = self.perf_report_times
+        
+        overall_cpu = {}
+        for report_time in report_times:
+            if report_time in self.report_time_codes and self.report_time_codes[report_time] in self.perf_time_seen:
+                overall_cpu[report_time] = {}
+        
+        selected_hosts = {}
+        for host_id in host_ids:
+            if host_id in self.host_codes:
+                selected_hosts[self.host_codes[host_id]] = host_id
+        
+        for index in xrange(len(self.perf_time)):
+            host_code = self.perf_host[index]
+            report_time = self.report_times[self.perf_time[index]]
+            if host_code in selected_hosts and report_time in overall_cpu:
+                overall_cpu[report_time][selected_hosts[host_code]] = self.perf_cpu[index]
+        
+        return overall_cpu
 
-    # get report time
-    match_result = re.search(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2})', measlog[begin])
+
+meas_store = MeasStore()
+
+
+# the patterns are compiled once, the literals are checked before running the patterns
+block_begin_literal = '+++'
+block_end_literal = '++-'
+report_time_pattern = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2})')
+SA_SPAMEAS_row_pattern = re.compile(r'(\d+)\s+(\S+)\s+(\d+)\s+\d+')
+MS_PROCESS_MEAS_row_pattern = re.compile(r'\d+\s+(\d+-\d+-\d+)\s+(\S+)\s+(\d+\.\d+)')
+MS_PERF_MEAS_row_pattern = re.compile(r'\d+\s+(\d+-\d+-\d+)\s+\d+\s+\d+\s+\d+\s+(\d+)')
+
+
+def parse_SA_SPAMEAS_row(line, report_time):
+    '''parse one line of SA_SPAMEAS table, return the information dict or None.'''
+    
+    match_result = SA_SPAMEAS_row_pattern.search(line)
     if match_result:
-        report_time = match_result.group(1)
-    else:
-        print 'Error: Failed to get report time of the message block.'
-        report_time = '1970-01-01 12:00'
+        SA_SPAMEAS_info = {}
+        SA_SPAMEAS_info['tps'] = int(match_result.group(3)) / int(match_result.group(1)) 
+        SA_SPAMEAS_info['spa_name'] =  match_result.group(2)
+        SA_SPAMEAS_info['report_time'] = report_time
+        return SA_SPAMEAS_info
+    
+    return None
+
+
+def parse_MS_PROCESS_MEAS_row(line, report_time):
+    '''parse one line of MS_PROCESS_MEAS table, return the information dict or None.'''
+    
+    #299  0-0-9   DIAMCL28I_2                     18.89
+    match_result = MS_PROCESS_MEAS_row_pattern.search(line)
+    if match_result:
+        MS_PROCESS_MEAS_info = {}
+        MS_PROCESS_MEAS_info['host_id'] = match_result.group(1)
+        MS_PROCESS_MEAS_info['process_name'] = match_result.group(2)
+        MS_PROCESS_MEAS_info['cpu_usage'] = match_result.group(3)
+        MS_PROCESS_MEAS_info['report_time'] = report_time
+        return MS_PROCESS_MEAS_info
+    
+    return None
 
-    return (begin, end, report_time)
 
+def parse_MS_PERF_MEAS_row(line, report_time):
+    '''parse one line of MS_PERF_MEAS table, return the information dict or None.'''
+    
+    #          299  0-0-2              1             0              0          98
+    match_result = MS_PERF_MEAS_row_pattern.search(line)
+    if match_result:
+        MS_PERF_MEAS_info = {}
+        MS_PERF_MEAS_info['host_id'] = match_result.group(1)
+        MS_PERF_MEAS_info['overall_cpu_usage'] = 100 - int(match_result.group(2))
+        MS_PERF_MEAS_info['report_time'] = report_time
+        return MS_PERF_MEAS_info
+    
+    return None
 
-def analyze_measlog(measlog):
-    '''this function receives the measlog content, analyze the following tables:
-    1. SA_SPAMEAS
-    2. MS_PROCESS_MEAS
-    and save the useful information in the lists respectively.
+
+# (table name, marker of the table, row parser) for the tables we are interested in
+measlog_table_definition = (('SA_SPAMEAS', 'Measurements for SA_SPAMEAS table', parse_SA_SPAMEAS_row),
+                            ('MS_PROCESS_MEAS', 'Measurements for MS_PROCESS_MEAS table', parse_MS_PROCESS_MEAS_row),
+                            ('MS_PERF_MEAS', 'Control Computer Performance Measurements for MS_PERF_MEAS table', parse_MS_PERF_MEAS_row)
+                            )
+
+# all the markers are matched by one pattern, the name of the matched group is the table name.
+# the common part of the markers is checked before running the pattern.
+measlog_table_marker_literal = 'Measurements for '
+measlog_table_marker_pattern = re.compile('|'.join(['(?P<%s>%s)' % (table_name, re.escape(marker)) \
+                                                    for table_name, marker, row_parser in measlog_table_definition]))
+measlog_row_parsers = dict([(table_name, row_parser) for table_name, marker, row_parser in measlog_table_definition])
+
+
+# the report time of the block of the interested tables without a report time in its header line
+unknown_report_time = '1970-01-01 12:00'
+
+
+def find_report_time(line):
+    '''return the report time in the header line of a message block, None if it is not found.'''
+    
+    match_result = report_time_pattern.search(line)
+    if match_result:
+        return match_result.group(1)
+    return None
+
+
+def get_report_time(line):
+    '''get the report time from the header line of a message block. format: 'YYYY-MM-DD hh:mm' '''
+    
+    report_time = find_report_time(line)
+    if report_time is None:
+        print 'Error: Failed to get report time of the message block.'
+        return unknown_report_time
+    return report_time
+
+
+class MeasFilter(object):
+    '''this class tells which measurements are saved, it is applied by the parsers:
+    1. report time window [time_from, time_to]: the blocks out of the window are skipped by their header line,
+       the rows are not parsed. a bound may be a prefix of 'YYYY-MM-DD hh:mm', e.g. time_to '2016-03-07'
+       includes the whole day.
+    2. hosts: the rows of MS_PROCESS_MEAS and MS_PERF_MEAS tables are saved only for the host ids in host_ids
+       and the hosts of the roles in roles, 'app' stands for the hosts without a role in host_role_definition.
+    3. tables: only the blocks of these tables are parsed, the blocks of the other tables are skipped as soon
+       as their table marker is found.
+    None means no filter.
     '''
     
-    num = 0
-    while num < len(measlog):
+    def __init__(self, time_from = None, time_to = None, host_ids = None, roles = None, tables = None):
+        self.time_from = time_from
+        self.time_to = time_to
+        self.host_ids = host_ids
+        self.roles = roles
+        self.tables = tables
+        self.host_accepted = {}
+    
+    def is_host_filtered(self):
+        return self.host_ids is not None or self.roles is not None
+    
+    def accept_table(self, table_name):
+        return self.tables is None or table_name in self.tables
+    
+    def accept_time(self, report_time):
+        if self.time_from is not None and report_time[:len(self.time_from)] < self.time_from:
+            return False
+        if self.time_to is not None and report_time[:len(self.time_to)] > self.time_to:
+            return False
+        return True
+    
+    def accept_host(self, host_id):
+        accepted = self.host_accepted.get(host_id)
+        if accepted is None:
+            accepted = not self.is_host_filtered() or \
+                       (self.host_ids is not None and host_id in self.host_ids) or \
+                       (self.roles is not None and (host_topology.get_role(host_id) or 'app') in self.roles)
+            self.host_accepted[host_id] = accepted
+        return accepted
+    
+    def accept_row(self, table_name, info):
+        '''tell whether the row parsed from the table is saved, only the host of the row is checked.'''
         
-        # analyze SA_SPAMEAS table
-        if re.search(r'Measurements for SA_SPAMEAS table', measlog[num]) is not None:
+        return table_name == 'SA_SPAMEAS' or self.accept_host(info['host_id'])
 
-            # get the information of current block
-            begin, end, report_time = get_block_info(measlog, num)
 
-            # get useful information
-            num = begin
-            while num < end:
-                match_result = re.search(r'(\d+)\s+(\S+)\s+(\d+)\s+\d+', measlog[num])
+class MeasBlockParser(object):
+    '''this class receives the measlog content line by line and tracks the current '+++ ... ++-' message block.
+    the lines of a block are buffered only until the table of the block is known, after that each line is
+    parsed as soon as it is received, so the memory usage does not depend on the size of the measlog.
+    the blocks and rows rejected by meas_filter are skipped, see MeasFilter.
+    '''
+    
+    def __init__(self, meas_filter = None):
+        self.meas_filter = meas_filter
+        self.block_lines = None     # buffered lines of current block, None when we are outside of a block
+        self.report_time = None
+        self.table_name = None
+        self.row_parser = None
+        self.rows = []
+    
+    def start_block(self, line):
+        '''start a new message block with its header line.'''
+        
+        # the header line without report time is reported only if the block is of the interested tables,
+        # e.g. the '+++++-----' banner lines are not
+        self.report_time = find_report_time(line)
+        self.table_name = self.row_parser = None
+        self.rows = []
+        
+        # skip the block out of the report time window, as if we are outside of a block
+        if self.meas_filter is not None and not self.meas_filter.accept_time(self.report_time or unknown_report_time):
+            self.block_lines = None
+            return
+        
+        self.block_lines = []
+        self.parse_line(line)
+    
+    def parse_line(self, line):
+        '''buffer the line if the table is still unknown, otherwise parse it.'''
+        
+        if self.row_parser is None:
+            self.block_lines.append(line)
+            
+            if measlog_table_marker_literal in line:
+                match_result = measlog_table_marker_pattern.search(line)
                 if match_result:
-                    SA_SPAMEAS_info = {}
-                    SA_SPAMEAS_info['tps'] = int(match_result.group(3)) / int(match_result.group(1)) 
-                    SA_SPAMEAS_info['spa_name'] =  match_result.group(2)
-                    SA_SPAMEAS_info['report_time'] = report_time
                     
-                    # save the information
-                    SA_SPAMEAS_infolist.append(SA_SPAMEAS_info)
-                
-                num += 1
-            else:
-                print 'Finished processing [', report_time, '] SA_SPAMEAS table;'
+                    # skip the block of the table not selected, as if we are outside of a block
+                    if self.meas_filter is not None and not self.meas_filter.accept_table(match_result.lastgroup):
+                        self.block_lines = None
+                        return
+                    
+                    self.table_name = match_result.lastgroup
+                    self.row_parser = measlog_row_parsers[self.table_name]
+                    if self.report_time is None:
+                        self.report_time = get_report_time(self.block_lines[0])
+                    
+                    # parse the lines received before the table marker
+                    for block_line in self.block_lines:
+                        self.parse_row(block_line)
+                    self.block_lines = []
+        else:
+            self.parse_row(line)
+    
+    def parse_row(self, line):
+        info = self.row_parser(line, self.report_time)
+        if info is not None and (self.meas_filter is None or self.meas_filter.accept_row(self.table_name, info)):
+            self.rows.append(info)
+    
+    def feed_line(self, line):
+        '''feed one line of measlog, return (table_name, report_time, rows) when a block of the interested
+        tables is finished, otherwise return None.
+        '''
+        
+        if block_begin_literal in line:
+            self.start_block(line)
+            return None
+        
+        # ignore the lines out of message blocks
+        if self.block_lines is None:
+            return None
         
-        # analyze MS_PROCESS_MEAS table
-        if re.search(r'Measurements for MS_PROCESS_MEAS table', measlog[num]) is not None:
+        if block_end_literal in line:
+            block = None
+            if self.table_name is not None:
+                block = (self.table_name, self.report_time, self.rows)
+            
+            self.block_lines = None
+            self.table_name = self.row_parser = None
+            self.rows = []
+            return block
+        
+        self.parse_line(line)
+        return None
 
-            # get the information of current block
-            begin, end, report_time = get_block_info(measlog, num)
 
-            # get useful information
-            num = begin
-            while num < end:
-                #299  0-0-9   DIAMCL28I_2                     18.89
-                match_result = re.search(r'\d+\s+(\d+-\d+-\d+)\s+(\S+)\s+(\d+\.\d+)', measlog[num])
-                if match_result:
-                    MS_PROCESS_MEAS_info = {}
-                    MS_PROCESS_MEAS_info['host_id'] = match_result.group(1)
-                    MS_PROCESS_MEAS_info['process_name'] = match_result.group(2)
-                    MS_PROCESS_MEAS_info['cpu_usage'] = match_result.group(3)
-                    MS_PROCESS_MEAS_info['report_time'] = report_time
-                    
-                    # save the information
-                    MS_PROCESS_MEAS_infolist.append(MS_PROCESS_MEAS_info)
-                
-                num += 1
-            else:
-                print 'Finished processing [', report_time, '] MS_PROCESS_MEAS table;'
+def iter_measlog_blocks(measlog, meas_filter = None):
+    '''this generator receives the measlog content (any iterable of lines, e.g. an opened file), read it in
+    a single pass and yield (table_name, report_time, rows) for each block of the following tables:
+    1. SA_SPAMEAS
+    2. MS_PROCESS_MEAS
+    3. MS_PERF_MEAS
+    the block not finished by '++-' at the end of measlog is dropped, and so are the blocks and rows
+    rejected by meas_filter.
+    '''
+    
+    parser = MeasBlockParser(meas_filter)
+    for line in measlog:
+        block = parser.feed_line(line)
+        if block is not None:
+            yield block
+
+
+def iter_mapped_measlog_blocks(buf, begin = 0, end = None, meas_filter = None):
+    '''this generator works like iter_measlog_blocks(), but on a buffer of the measlog content, e.g. a mmap
+    of the measlog file, from offset begin to end. the block boundaries and the table markers are searched
+    in the buffer directly, only the blocks of the interested tables are copied and split into lines.
+    '''
+    
+    if end is None:
+        end = len(buf)
+    
+    pos = begin
+    while pos < end:
         
+        # find the first line closing a block after the line of the next '+++', the '++-' on the same line
+        # as '+++' does not close the block (e.g. a '+++++-----' banner)
+        header = buf.find(block_begin_literal, pos, end)
+        if header < 0:
+            return
+        header_line_end = buf.find('\n', header, end)
+        if header_line_end < 0:
+            return
+        trailer = buf.find(block_end_literal, header_line_end, end)
+        if trailer < 0:
+            return
+        trailer_line_begin = max(begin, buf.rfind('\n', begin, trailer) + 1)
+        trailer_line_end = buf.find('\n', trailer, end)
+        trailer_line_end = end if trailer_line_end < 0 else trailer_line_end + 1
         
-        # analyze MS_PERF_MEAS table
-        if re.search(r'Control Computer Performance Measurements for MS_PERF_MEAS table', measlog[num]) is not None:
+        # a line with both '+++' and '++-' begins a new block
+        if buf.find(block_begin_literal, trailer_line_begin, trailer_line_end) >= 0:
+            pos = trailer_line_begin
+            continue
+        
+        # the block begins with the last '+++' line before the closing line
+        header = buf.rfind(block_begin_literal, header, trailer_line_begin)
+        header_line_begin = max(begin, buf.rfind('\n', begin, header) + 1)
+        pos = trailer_line_end
+        
+        # find the first table marker in the block
+        marker_pos = table_name = None
+        for item_table_name, marker, row_parser in measlog_table_definition:
+            item_marker_pos = buf.find(marker, header_line_begin, trailer_line_begin)
+            if item_marker_pos >= 0 and (marker_pos is None or item_marker_pos < marker_pos):
+                marker_pos, table_name = item_marker_pos, item_table_name
+        if table_name is None or (meas_filter is not None and not meas_filter.accept_table(table_name)):
+            continue
+        
+        header_line_end = buf.find('\n', header, trailer_line_begin)
+        report_time = get_report_time(buf[header_line_begin:trailer_line_begin if header_line_end < 0 else header_line_end])
+        if meas_filter is not None and not meas_filter.accept_time(report_time):
+            continue
+        
+        lines = buf[header_line_begin:trailer_line_begin].split('\n')
+        row_parser = measlog_row_parsers[table_name]
+        rows = []
+        for line in lines:
+            info = row_parser(line, report_time)
+            if info is not None and (meas_filter is None or meas_filter.accept_row(table_name, info)):
+                rows.append(info)
+        
+        yield (table_name, report_time, rows)
 
-            # get the information of current block
-            begin, end, report_time = get_block_info(measlog, num)
 
-            # get useful information
-            num = begin
-            while num < end:
-                #          299  0-0-2              1             0              0          98
-                match_result = re.search(r'\d+\s+(\d+-\d+-\d+)\s+\d+\s+\d+\s+\d+\s+(\d+)', measlog[num])
-                if match_result:
-                    MS_PERF_MEAS_info = {}
-                    MS_PERF_MEAS_info['host_id'] = match_result.group(1)
-                    MS_PERF_MEAS_info['overall_cpu_usage'] = 100 - int(match_result.group(2))
-                    MS_PERF_MEAS_info['report_time'] = report_time
+# the compressed measlog files are recognized by the magic bytes at the beginning
+measlog_compression_magics = (('gzip', '\x1f\x8b'), ('bz2', 'BZh'), ('xz', '\xfd7zXZ\x00'))
+
+
+def get_measlog_compression(path):
+    '''return 'gzip', 'bz2' or 'xz' if the measlog file is compressed, None otherwise.'''
+    
+    if not os.path.isfile(path):
+        return None
+    
+    f = open(path, 'rb')
+    try:
+        head = f.read(6)
+    finally:
+        f.close()
+    
+    for compression, magic in measlog_compression_magics:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def new_decompressor(compression):
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 'bz2':
+        return bz2.BZ2Decompressor()
+    else:
+        return get_optional_module('lzma', 'backports.lzma').LZMADecompressor()
+
+
+def iter_measlog_data(path, read_size = 1024 * 1024):
+    '''read the measlog file in read_size pieces and yield the content, the compressed file is decompressed
+    piece by piece. the concatenated streams of a compressed file (e.g. cat a.gz b.gz) are supported.
+    the xz compressed file is reported and skipped if the lzma module is not installed.
+    '''
+    
+    compression = get_measlog_compression(path)
+    if compression == 'xz' and get_optional_module('lzma', 'backports.lzma') is None:
+        print 'Error: the lzma module is required for the xz compressed measlog file', path
+        return
+    
+    f = open(path, 'rb')
+    try:
+        decompressor = None
+        while True:
+            data = f.read(read_size)
+            if not data:
+                break
+            if compression is None:
+                yield data
+                continue
+            
+            while data:
+                if decompressor is None:
                     
-                    # save the information
-                    MS_PERF_MEAS_infolist.append(MS_PERF_MEAS_info)
-                
-                num += 1
-            else:
-                print 'Finished processing [', report_time, '] MS_PERF_MEAS table;'
-                
+                    # the zero padding after a stream is ignored, it may begin in the next read
+                    data = data.lstrip('\x00')
+                    if not data:
+                        break
+                    decompressor = new_decompressor(compression)
+                try:
+                    content = decompressor.decompress(data)
+                except EOFError:
+                    # the stream is finished, data begins the next stream
+                    decompressor = None
+                    continue
+                yield content
                 
-        # increase line number
-        num += 1
+                # the data after the end of the stream begins the next stream
+                data = decompressor.unused_data
+                if data:
+                    decompressor = None
+    finally:
+        f.close()
+
+
+def iter_compressed_measlog_blocks(path, read_size = 1024 * 1024, meas_filter = None):
+    '''yield the blocks of the compressed measlog file, it is decompressed while it is parsed.
+    the decompressed content is cut before the last '+++' line of each piece, so no message block is split
+    between two pieces, and each piece is scanned by iter_mapped_measlog_blocks().
+    '''
+    
+    pending = ''
+    for content in iter_measlog_data(path, read_size):
+        pending += content
+        header = pending.rfind(block_begin_literal)
+        if header < 0:
+            continue
+        header_line_begin = pending.rfind('\n', 0, header) + 1
+        if header_line_begin == 0:
+            continue
+        
+        for block in iter_mapped_measlog_blocks(pending, 0, header_line_begin, meas_filter):
+            yield block
+        pending = pending[header_line_begin:]
+    
+    for block in iter_mapped_measlog_blocks(pending, meas_filter = meas_filter):
+        yield block
+
+
+def iter_measlog_file_blocks(path, begin = 0, end = None, meas_filter = None):
+    '''yield the blocks of the measlog file from offset begin to end, the file is memory-mapped.
+    the compressed file is always parsed as a whole, see iter_compressed_measlog_blocks().
+    '''
+    
+    compression = get_measlog_compression(path)
+    if compression is not None:
+        for block in iter_compressed_measlog_blocks(path, meas_filter = meas_filter):
+            yield block
+        return
+    
+    f = open(path, 'rb')
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        buf = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        try:
+            for block in iter_mapped_measlog_blocks(buf, begin, end, meas_filter):
+                yield block
+        finally:
+            buf.close()
+    finally:
+        f.close()
+
+
+def save_block(table_name, report_time, rows):
+    '''save the rows of a block into meas_store.'''
+    
+    meas_store.add_block(table_name, report_time, rows)
+    print 'Finished processing [', report_time, ']', table_name, 'table;'
+
+
+def analyze_measlog(measlog, cache_columns = None, meas_filter = None):
+    '''this function receives the measlog content, analyze the following tables:
+    1. SA_SPAMEAS
+    2. MS_PROCESS_MEAS
+    3. MS_PERF_MEAS
+    and save the useful information accepted by meas_filter in meas_store, and in cache_columns if it is given.
+    '''
+    
+    analyze_measlog_blocks(iter_measlog_blocks(measlog, meas_filter), cache_columns)
+
+    return
 
 
-    #print SA_SPAMEAS_infolist
-    #print MS_PROCESS_MEAS_infolist
-    #print MS_PERF_MEAS_infolist
+def analyze_measlog_blocks(blocks, cache_columns = None):
+    '''save the blocks from iter_measlog_blocks() or iter_measlog_file_blocks() in meas_store, and in
+    cache_columns if it is given.
+    '''
+    
+    for table_name, report_time, rows in blocks:
+        
+        # save the information
+        save_block(table_name, report_time, rows)
+        if cache_columns is not None:
+            cache_columns.add_block(table_name, report_time, rows)
 
     return
 
 
+def list_measlog_files(paths):
+    '''expand the directories in paths, return the list of measlog files.
+    the files in a directory are sorted by name.
+    '''
+    
+    measlog_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for file_name in sorted(os.listdir(path)):
+                if file_name.endswith(measlog_cache_suffix) or file_name.endswith(measlog_cache_suffix + '.tmp'):
+                    continue
+                if os.path.isfile(os.path.join(path, file_name)):
+                    measlog_files.append(os.path.join(path, file_name))
+        else:
+            measlog_files.append(path)
+    
+    return measlog_files
+
+
+def split_measlog(path, chunk_size):
+    '''split the measlog file into chunks of about chunk_size bytes, return [(path, begin, end), ...].
+    each chunk except the first one begins at a '+++' line, so no message block is split between chunks.
+    the compressed file is not split, it is decompressed by one worker process.
+    '''
+    
+    file_size = os.path.getsize(path)
+    if get_measlog_compression(path) is not None:
+        return [(path, 0, file_size)]
+    
+    boundaries = [0]
+    f = open(path, 'rb')
+    try:
+        offset = chunk_size
+        while offset < file_size:
+            
+            # move to the beginning of the next line, then look for the next block header
+            f.seek(offset - 1)
+            f.readline()
+            while True:
+                line_offset = f.tell()
+                line = f.readline()
+                if not line:
+                    line_offset = file_size
+                    break
+                if block_begin_literal in line:
+                    break
+            
+            if line_offset >= file_size:
+                break
+            boundaries.append(line_offset)
+            offset = max(line_offset + 1, offset + chunk_size)
+    finally:
+        f.close()
+    boundaries.append(file_size)
+    
+    chunks = []
+    for index in range(len(boundaries) - 1):
+        if boundaries[index] < boundaries[index + 1]:
+            chunks.append((path, boundaries[index], boundaries[index + 1]))
+    
+    return chunks
+
+
+def parse_measlog_chunk(task):
+    '''parse a chunk returned by split_measlog() with the MeasFilter, task is (path, begin, end, meas_filter).
+    return the list of (table_name, report_time, rows).
+    this function runs in the worker processes, so it only returns the blocks and never touches meas_store.
+    '''
+    
+    path, begin, end, meas_filter = task
+    
+    return list(iter_measlog_file_blocks(path, begin, end, meas_filter))
+
+
+# the parsed tables of a measlog file are cached in '<measlog file>.cmcache':
+# 1. magic line
+# 2. json header: signature of the measlog, the interned strings and the length of each array
+# 3. the arrays of ColumnarMeasStore, in the machine byte order
+measlog_cache_suffix = '.cmcache'
+measlog_cache_magic = 'CALCMEAS-CACHE 1\n'
+
+
+def get_measlog_signature(path):
+    '''return the signature of the measlog file: absolute path, size and mtime.'''
+    
+    stat = os.stat(path)
+    return {'path' : os.path.abspath(path), 'size' : stat.st_size, 'mtime' : stat.st_mtime}
+
+
+def get_file_md5(path, size):
+    '''return the md5 of the first size bytes of the file.'''
+    
+    import hashlib
+    md5 = hashlib.md5()
+    f = open(path, 'rb')
+    try:
+        while size > 0:
+            data = f.read(min(size, 1024 * 1024))
+            if not data:
+                break
+            md5.update(data)
+            size -= len(data)
+    finally:
+        f.close()
+    
+    return md5.hexdigest()
+
+
+def save_measlog_cache(path, columns, signature):
+    '''save the parsed tables (a ColumnarMeasStore) of the measlog file into its cache file.
+    signature is the one got before the measlog is parsed.
+    '''
+    
+    signature = dict(signature)
+    signature['md5'] = get_file_md5(path, signature['size'])
+    
+    header = {}
+    header['signature'] = signature
+    header['byteorder'] = sys.byteorder
+    header['cpu_typecode'] = columns.cpu_typecode
+    header['itemsize'] = {'i' : array('i').itemsize, columns.cpu_typecode : array(columns.cpu_typecode).itemsize}
+    header['report_times'] = columns.report_times
+    header['host_ids'] = columns.host_ids
+    header['names'] = columns.names
+    header['process_report_times'] = columns.process_report_times
+    header['perf_report_times'] = columns.perf_report_times
+    header['lengths'] = dict([(name, len(getattr(columns, name))) for name, typecode in columns.columns])
+    # the names in the measlog are not always utf-8, latin-1 keeps any byte of them
+    header_line = json.dumps(header, encoding = 'latin-1') + '\n'
+    
+    # write a temporary file then rename it, so a broken cache file is never left
+    cache_path = path + measlog_cache_suffix
+    try:
+        f = open(cache_path + '.tmp', 'wb')
+        try:
+            f.write(measlog_cache_magic)
+            f.write(header_line)
+            for name, typecode in columns.columns:
+                getattr(columns, name).tofile(f)
+        finally:
+            f.close()
+        os.rename(cache_path + '.tmp', cache_path)
+    except:
+        if os.path.exists(cache_path + '.tmp'):
+            os.remove(cache_path + '.tmp')
+        raise
+
+
+def load_measlog_cache(path):
+    '''return the parsed tables (a ColumnarMeasStore) loaded from the cache file of the measlog file.
+    None is returned if there is no cache file, or the measlog file is changed after the cache is saved.
+    '''
+    
+    cache_path = path + measlog_cache_suffix
+    if not os.path.isfile(cache_path):
+        return None
+    
+    try:
+        f = open(cache_path, 'rb')
+        try:
+            if f.readline() != measlog_cache_magic:
+                return None
+            header = json.loads(f.readline())
+            
+            # check the measlog file by path, size and mtime first, then by the content
+            signature = get_measlog_signature(path)
+            cached_signature = header['signature']
+            for key in ('path', 'size', 'mtime'):
+                if cached_signature[key] != signature[key]:
+                    return None
+            cpu_typecode = str(header['cpu_typecode'])
+            if header['byteorder'] != sys.byteorder or \
+            header['itemsize'].get('i') != array('i').itemsize or \
+            header['itemsize'].get(cpu_typecode) != array(cpu_typecode).itemsize:
+                return None
+            if get_file_md5(path, signature['size']) != cached_signature['md5']:
+                return None
+            
+            columns = ColumnarMeasStore(cpu_typecode)
+            for name, typecode in columns.columns:
+                getattr(columns, name).fromfile(f, header['lengths'][name])
+        finally:
+            f.close()
+    except (IOError, EOFError, ValueError, KeyError):
+        return None
+    
+    # the strings in json are unicode, they are saved as latin-1
+    for values, codes, key in ((columns.report_times, columns.report_time_codes, 'report_times'),
+                               (columns.host_ids, columns.host_codes, 'host_ids'),
+                               (columns.names, columns.name_codes, 'names')):
+        for value in header[key]:
+            columns.intern(value.encode('latin-1'), values, codes)
+    for report_time in header['process_report_times']:
+        report_time = report_time.encode('latin-1')
+        columns.process_report_times.append(report_time)
+        columns.process_time_seen[columns.report_time_codes[report_time]] = True
+    for report_time in header['perf_report_times']:
+        report_time = report_time.encode('latin-1')
+        columns.perf_report_times.append(report_time)
+        columns.perf_time_seen[columns.report_time_codes[report_time]] = True
+    
+    return columns
+
+
+def save_cached_measlog(path, columns, signature):
+    '''save the parsed tables of the measlog file into its cache file, a failure is not fatal.'''
+    
+    try:
+        save_measlog_cache(path, columns, signature)
+    except (IOError, OSError, ValueError), e:
+        print 'Warning: Failed to save parsed cache of', path, ':', e
+
+
+# the measurements of all the analyzed measlog files can be kept in a SQLite database (the warehouse),
+# a row is identified by its report time, host and process (or spa), so loading a measlog again replaces
+# its rows instead of adding them again.
+warehouse_schema = (
+    '''CREATE TABLE IF NOT EXISTS spa_meas (
+        report_time TEXT NOT NULL, spa_name TEXT NOT NULL, tps INTEGER NOT NULL,
+        PRIMARY KEY (report_time, spa_name))''',
+    '''CREATE TABLE IF NOT EXISTS process_meas (
+        report_time TEXT NOT NULL, host_id TEXT NOT NULL, process_name TEXT NOT NULL, cpu_usage REAL NOT NULL,
+        PRIMARY KEY (report_time, host_id, process_name))''',
+    '''CREATE INDEX IF NOT EXISTS process_meas_process_name ON process_meas (process_name, report_time)''',
+    '''CREATE TABLE IF NOT EXISTS perf_meas (
+        report_time TEXT NOT NULL, host_id TEXT NOT NULL, overall_cpu_usage INTEGER NOT NULL,
+        PRIMARY KEY (report_time, host_id))''',
+    )
+
+warehouse_batch_size = 50000
+
+# warehouse table -> measlog table
+warehouse_table_names = {'spa_meas' : 'SA_SPAMEAS', 'process_meas' : 'MS_PROCESS_MEAS', 'perf_meas' : 'MS_PERF_MEAS'}
+
+
+def open_warehouse(path):
+    '''open the warehouse database, the tables are created if they do not exist.'''
+    
+    import sqlite3
+    conn = sqlite3.connect(path)
+    conn.text_factory = str
+    for statement in warehouse_schema:
+        conn.execute(statement)
+    conn.commit()
+    
+    return conn
+
+
+def save_warehouse_rows(conn, statement, rows):
+    '''insert the rows by the statement, each warehouse_batch_size rows are committed in one transaction.
+    return the number of rows.
+    '''
+    
+    row_num = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= warehouse_batch_size:
+            conn.executemany(statement, batch)
+            conn.commit()
+            row_num += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(statement, batch)
+        conn.commit()
+        row_num += len(batch)
+    
+    return row_num
+
+
+def save_warehouse(path, store):
+    '''load the measurements of the store into the warehouse database, the rows of the same report time,
+    host and process are replaced. return the number of rows.
+    '''
+    
+    conn = open_warehouse(path)
+    try:
+        row_num = save_warehouse_rows(conn, 'INSERT OR REPLACE INTO spa_meas VALUES (?, ?, ?)', store.get_spa_meas())
+        row_num += save_warehouse_rows(conn, 'INSERT OR REPLACE INTO process_meas VALUES (?, ?, ?, ?)', store.iter_process_meas())
+        row_num += save_warehouse_rows(conn, 'INSERT OR REPLACE INTO perf_meas VALUES (?, ?, ?)', store.iter_perf_meas())
+    finally:
+        conn.close()
+    
+    return row_num
+
+
+class WarehouseMeasStore(object):
+    '''this class answers the queries of MeasStore (get_*() and aggregate_*()) by SQL against the warehouse
+    database, so the reports are generated without parsing the measlog files again. the measurements are
+    read only, see save_warehouse() for loading them.
+    only the measurements accepted by meas_filter are queried.
+    note the sums are calculated by SQLite, the averages may differ from MeasStore in the last digit.
+    '''
+    
+    def __init__(self, path, meas_filter = None):
+        self.conn = open_warehouse(path)
+        self.meas_filter = meas_filter
+    
+    def get_time_condition(self, column = 'report_time'):
+        '''return (sql, parameters) of the report time window of meas_filter.'''
+        
+        conditions = ['1']
+        parameters = []
+        if self.meas_filter is not None and self.meas_filter.time_from is not None:
+            conditions.append('substr(%s, 1, %d) >= ?' % (column, len(self.meas_filter.time_from)))
+            parameters.append(self.meas_filter.time_from)
+        if self.meas_filter is not None and self.meas_filter.time_to is not None:
+            conditions.append('substr(%s, 1, %d) <= ?' % (column, len(self.meas_filter.time_to)))
+            parameters.append(self.meas_filter.time_to)
+        
+        return ' AND '.join(conditions), parameters
+    
+    def get_host_ids(self, table):
+        '''return the host ids of the table accepted by meas_filter.'''
+        
+        host_ids = [row[0] for row in self.conn.execute('SELECT DISTINCT host_id FROM %s' % table)]
+        if self.meas_filter is not None:
+            host_ids = [host_id for host_id in host_ids if self.meas_filter.accept_host(host_id)]
+        return host_ids
+    
+    def accept_table(self, table):
+        '''tell whether the table of the warehouse is selected by meas_filter.'''
+        
+        return self.meas_filter is None or self.meas_filter.accept_table(warehouse_table_names[table])
+    
+    def get_report_times(self, table):
+        if not self.accept_table(table):
+            return []
+        condition, parameters = self.get_time_condition()
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT report_time FROM %s WHERE %s ORDER BY report_time' % \
+                                                    (table, condition), parameters)]
+    
+    def get_spa_meas(self):
+        if not self.accept_table('spa_meas'):
+            return []
+        condition, parameters = self.get_time_condition()
+        return self.conn.execute('SELECT report_time, spa_name, tps FROM spa_meas WHERE %s ORDER BY report_time, spa_name' % \
+                                 condition, parameters).fetchall()
+    
+    def get_process_report_times(self):
+        return self.get_report_times('process_meas')
+    
+    def get_perf_report_times(self):
+        return self.get_report_times('perf_meas')
+    
+    def get_row_counts(self):
+        row_counts = {}
+        for table, table_name in warehouse_table_names.items():
+            row_counts[table_name] = self.conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0]
+        return row_counts
+    
+    def aggregate_process_cpu(self, is_matched, role_groups, default_group, report_times = None):
+        return self.aggregate_processes_cpu([is_matched], role_groups, default_group, report_times)[0]
+    
+    def aggregate_processes_cpu(self, matchers, role_groups, default_group, report_times = None):
+        
+        # match each name against the matchers and classify each host in python, the rows are joined with them
+        role_code_groups = host_topology.get_role_groups(role_groups, default_group)
+        groups = []
+        host_groups = []
+        for host_id in self.get_host_ids('process_meas'):
+            group = role_code_groups[host_topology.get_role_code(host_id)]
+            if group not in groups:
+                groups.append(group)
+            host_groups.append((host_id, groups.index(group)))
+        matched_processes = []
+        for (process_name,) in self.conn.execute('SELECT DISTINCT process_name FROM process_meas'):
+            for index in xrange(len(matchers)):
+                if matchers[index](process_name):
+                    matched_processes.append((index, process_name))
+        
+        self.conn.execute('DROP TABLE IF EXISTS temp.host_group')
+        self.conn.execute('DROP TABLE IF EXISTS temp.matched_process')
+        self.conn.execute('CREATE TEMP TABLE host_group (host_id TEXT PRIMARY KEY, group_code INTEGER)')
+        self.conn.execute('CREATE TEMP TABLE matched_process (matcher INTEGER, process_name TEXT)')
+        self.conn.executemany('INSERT INTO host_group VALUES (?, ?)', host_groups)
+        self.conn.executemany('INSERT INTO matched_process VALUES (?, ?)', matched_processes)
+        
+        condition, parameters = self.get_time_condition('p.report_time')
+        processes_cpu = [{} for matcher in matchers]
+        for report_time in self.get_process_report_times():
+            if report_times is None or report_time in report_times:
+                for process_cpu in processes_cpu:
+                    process_cpu[report_time] = {}
+        
+        for index, report_time, group_code, count, cpu_sum in self.conn.execute(
+            '''SELECT m.matcher, p.report_time, h.group_code, COUNT(*), SUM(p.cpu_usage)
+               FROM process_meas p JOIN matched_process m ON m.process_name = p.process_name
+                                   JOIN host_group h ON h.host_id = p.host_id
+               WHERE %s GROUP BY m.matcher, p.report_time, h.group_code''' % condition, parameters):
+            if report_time in processes_cpu[index]:
+                processes_cpu[index][report_time][groups[group_code]] = [count, cpu_sum]
+        
+        return processes_cpu
+    
+    def aggregate_overall_cpu(self, host_ids, report_times = None):
+        host_ids = [host_id for host_id in host_ids if self.meas_filter is None or self.meas_filter.accept_host(host_id)]
+        
+        overall_cpu = {}
+        for report_time in self.get_perf_report_times():
+            if report_times is None or report_time in report_times:
+                overall_cpu[report_time] = {}
+        
+        if host_ids:
+            condition, parameters = self.get_time_condition()
+            for report_time, host_id, overall_cpu_usage in self.conn.execute(
+                'SELECT report_time, host_id, overall_cpu_usage FROM perf_meas WHERE %s AND host_id IN (%s)' % \
+                (condition, ', '.join(['?'] * len(host_ids))), parameters + host_ids):
+                if report_time in overall_cpu:
+                    overall_cpu[report_time][host_id] = overall_cpu_usage
+        
+        return overall_cpu
+
+
+def analyze_measlog_files(paths, jobs = 1, chunk_size = 64 * 1024 * 1024, use_cache = False, meas_filter = None):
+    '''analyze the measlog files and the measlog files in the directories of paths.
+    when jobs > 1, the regular files are split into chunks and parsed by a pool of worker processes, the blocks
+    are saved into meas_store by this process in the order of the files. the other files (e.g. pipes) are
+    parsed by this process.
+    when use_cache is True, the parsed tables are loaded from the cache file next to each measlog file if
+    the measlog file is not changed, otherwise the cache file is (re)built after the measlog file is parsed.
+    only the measurements accepted by meas_filter are saved, the cache file is not built in this case since
+    it always keeps the whole measlog file.
+    '''
+    
+    measlog_files = list_measlog_files(paths)
+    
+    # the parsed tables loaded from the cache files, and the chunks of the other files for the worker processes
+    cached_files = {}
+    chunks = []
+    chunk_nums = []     # number of chunks of each file in measlog_files
+    for path in measlog_files:
+        chunk_num = 0
+        if use_cache:
+            columns = load_measlog_cache(path)
+            if columns is not None:
+                cached_files[path] = columns
+                chunk_nums.append(chunk_num)
+                continue
+        if jobs > 1 and os.path.isfile(path):
+            file_chunks = split_measlog(path, chunk_size)
+            chunks.extend(file_chunks)
+            chunk_num = len(file_chunks)
+        chunk_nums.append(chunk_num)
+    
+    pool = None
+    if chunks:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(parse_measlog_chunk, [chunk + (meas_filter,) for chunk in chunks])
+    
+    try:
+        for path, chunk_num in zip(measlog_files, chunk_nums):
+            print "Measurement log file: ", path
+            
+            if path in cached_files:
+                columns = cached_files.pop(path)
+                if meas_filter is not None:
+                    columns = columns.get_filtered(meas_filter)
+                meas_store.add_columns(columns)
+                print 'Loaded parsed cache', path + measlog_cache_suffix
+                continue
+            
+            cache_columns = signature = None
+            if use_cache and meas_filter is None:
+                signature = get_measlog_signature(path)
+                cache_columns = ColumnarMeasStore('d')
+            
+            if chunk_num:
+                
+                # take the results of the chunks of this file
+                for index in xrange(chunk_num):
+                    for table_name, report_time, rows in results.next():
+                        save_block(table_name, report_time, rows)
+                        if cache_columns is not None:
+                            cache_columns.add_block(table_name, report_time, rows)
+            elif os.path.isfile(path):
+                analyze_measlog_blocks(iter_measlog_file_blocks(path, meas_filter = meas_filter), cache_columns)
+            else:
+                f = open(path, 'r')
+                try:
+                    analyze_measlog(f, cache_columns, meas_filter)
+                finally:
+                    f.close()
+            
+            if cache_columns is not None:
+                save_cached_measlog(path, cache_columns, signature)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    return
+
+
 
 def get_summarized_data(report_list):
     '''this function calculates the total number and sum value for each numeric data in a dict-based list. 
@@ -162,22 +1561,152 @@ def get_summarized_data(report_list):
     outputs:
         it returns a dict containing the count and sum value of each numeric data in original dicts.
     '''
-    summarized_data = {}
+    summarized_data = {}
+    for item in report_list:
+        for key in item.keys():
+            if type(item[key]) in (int, float):
+                if not summarized_data.has_key(key + '(sum)'):
+                    summarized_data[key + '(cnt)'] = 1
+                    summarized_data[key + '(sum)'] = item[key]
+                else:
+                    summarized_data[key + '(cnt)'] += 1
+                    summarized_data[key + '(sum)'] += item[key]
+    
+    return summarized_data
+
+
+class QuantileSketch(object):
+    '''this class estimates the quantiles of a series of non-negative values in bounded memory: the values are
+    counted in logarithmic buckets, so each estimate is within relative_accuracy of a value of the series.
+    at most max_buckets buckets are kept, the lowest buckets are merged when there are more.
+    count, sum, min and max are exact.
+    '''
+    
+    def __init__(self, relative_accuracy = 0.01, max_buckets = 2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+    
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        
+        if value <= 0:
+            self.zero_count += 1
+            return
+        key = int(math.ceil(math.log(value) / self.log_gamma))
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+        
+        if len(self.buckets) > self.max_buckets:
+            keys = sorted(self.buckets.keys())
+            self.buckets[keys[1]] += self.buckets.pop(keys[0])
+    
+    def get_quantile(self, quantile):
+        '''return the estimated value at quantile (0 - 1), None if the series is empty.
+        quantile 0 and 1 return the exact min and max.
+        '''
+        
+        if self.count == 0:
+            return None
+        if quantile <= 0:
+            return self.min
+        if quantile >= 1:
+            return self.max
+        
+        rank = quantile * (self.count - 1)
+        if rank < self.zero_count:
+            return max(0, self.min)
+        
+        seen = self.zero_count
+        for key in sorted(self.buckets.keys()):
+            seen += self.buckets[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        
+        return self.max
+
+
+class RollingWindow(object):
+    '''this class keeps the last size values of a series, add() returns the average of them.'''
+    
+    def __init__(self, size):
+        self.values = deque()
+        self.size = size
+    
+    def add(self, value):
+        self.values.append(value)
+        if len(self.values) > self.size:
+            self.values.popleft()
+        return sum(self.values) / float(len(self.values))
+
+
+# the KPIs of the reports which have percentiles and rolling averages
+epay_kpi_keys = ('tps', 'std_client_cpu_usage', 'std_client_call_cost', 'cr_spc_client_cpu_usage', 'cr_spc_client_call_cost',
+                 'nt_spc_client_cpu_usage', 'nt_spc_client_call_cost')
+process_cpu_keys = ('pilot_cpu', 'db_cpu', 'io_cpu', 'app_cpu')
+
+# the percentiles printed by --percentiles, 100 is printed as MAX
+report_percentiles = (50, 95, 99, 100)
+
+
+def get_percentile_data(report_list, keys, percentiles):
+    '''this function estimates the percentiles of the specified numeric data in a dict-based list.
+    it returns [(label, {key: value}), ...] for each percentile, label is 'P95' or 'MAX'.
+    '''
+    
+    sketches = {}
+    for key in keys:
+        sketches[key] = QuantileSketch()
+    for item in report_list:
+        for key in keys:
+            sketches[key].add(item[key])
+    
+    percentile_data = []
+    for percentile in percentiles:
+        values = {}
+        for key in keys:
+            values[key] = sketches[key].get_quantile(percentile / 100.0)
+        percentile_data.append((percentile == 100 and 'MAX' or 'P%d' % percentile, values))
+    
+    return percentile_data
+
+
+def get_rolling_report_list(report_list, keys, window_size, integer_keys = ()):
+    '''return a copy of the dict-based list, the specified numeric data of each item are replaced by the average
+    of the last window_size items. the averages of integer_keys are rounded.
+    '''
+    
+    windows = {}
+    for key in keys:
+        windows[key] = RollingWindow(window_size)
+    
+    rolling_report_list = []
     for item in report_list:
-        for key in item.keys():
-            if type(item[key]) in (int, float):
-                if not summarized_data.has_key(key + '(sum)'):
-                    summarized_data[key + '(cnt)'] = 1
-                    summarized_data[key + '(sum)'] = item[key]
-                else:
-                    summarized_data[key + '(cnt)'] += 1
-                    summarized_data[key + '(sum)'] += item[key]
+        rolling_item = dict(item)
+        for key in keys:
+            value = windows[key].add(item[key])
+            if key in integer_keys:
+                value = int(round(value))
+            rolling_item[key] = value
+        rolling_report_list.append(rolling_item)
     
-    return summarized_data
+    return rolling_report_list
 
 
-def generate_reports():
-    '''this function reads information from infolist then calculate the KPIs and print the report.
+def calc_epay_kpi_list(report_times = None):
+    '''this function reads information from meas_store then calculate the EPAY KPIs, return epay_kpi_list.
+    only the specified report times are calculated if report_times is given.
     assumption: 
     1. Only one EPAY version installed on the system.
     2. EPAY call routing clients on "db1", notification clients on "io", all standard clients on other blades.
@@ -187,43 +1716,32 @@ def generate_reports():
     spa_name = ''
     epay_kpi_list = []
     
-    # build epay_kpi_list from SA_SPAMEAS_infolist
-    for item in SA_SPAMEAS_infolist:
-        if item['spa_name'].find('EPAY') == 0:
-            spa_name = item['spa_name']
+    # build epay_kpi_list from SA_SPAMEAS table
+    for report_time, item_spa_name, tps in meas_store.get_spa_meas():
+        if item_spa_name.find('EPAY') == 0:
+            spa_name = item_spa_name
+            if report_times is not None and report_time not in report_times:
+                continue
             epay_kpi = {}
-            epay_kpi['report_time'] = item['report_time']
-            epay_kpi['tps'] = item['tps']
+            epay_kpi['report_time'] = report_time
+            epay_kpi['tps'] = tps
             epay_kpi_list.append(epay_kpi)
     
-    # add more KPIs to epay_kpi_list from MS_PROCESS_MEAS_infolist
+    # sum up the cpu usage of the clients from MS_PROCESS_MEAS table:
+    # call routing clients on "db1", notification clients on "io", standard clients on other blades
+    client_cpu = {}
+    if epay_kpi_list:
+        client_cpu = meas_store.aggregate_process_cpu(lambda process_name: process_name.find(spa_name + '_') == 0,
+                                                      {'db1' : 'cr_spc_client', 'io' : 'nt_spc_client'}, 'std_client',
+                                                      report_times)
+    
+    # add more KPIs to epay_kpi_list
     for epay_kpi in epay_kpi_list:
         
-        std_client_num = std_client_cpu_usage = 0
-        cr_spc_client_num = nt_spc_client_num = cr_spc_client_cpu_usage = nt_spc_client_cpu_usage = 0
-        for item in MS_PROCESS_MEAS_infolist:
-            
-            # calculate standard client average CPU usage
-            if item['report_time'] == epay_kpi['report_time'] and \
-            item['host_id'] not in host_role_definition['db1'] and \
-            item['host_id'] not in host_role_definition['io'] and \
-            item['process_name'].find(spa_name + '_') == 0:
-                std_client_num += 1
-                std_client_cpu_usage += float(item['cpu_usage'])
- 
-            # calculate specialized client (call routing) average CPU usage
-            if item['report_time'] == epay_kpi['report_time'] and \
-            item['host_id'] in host_role_definition['db1'] and \
-            item['process_name'].find(spa_name + '_') == 0:
-                cr_spc_client_num += 1
-                cr_spc_client_cpu_usage += float(item['cpu_usage'])
-                
-            # calculate specialized client (notification) average CPU usage
-            if item['report_time'] == epay_kpi['report_time'] and \
-            item['host_id'] in host_role_definition['io'] and \
-            item['process_name'].find(spa_name + '_') == 0:
-                nt_spc_client_num += 1
-                nt_spc_client_cpu_usage += float(item['cpu_usage'])
+        groups = client_cpu.get(epay_kpi['report_time'], {})
+        std_client_num, std_client_cpu_usage = groups.get('std_client', (0, 0))
+        cr_spc_client_num, cr_spc_client_cpu_usage = groups.get('cr_spc_client', (0, 0))
+        nt_spc_client_num, nt_spc_client_cpu_usage = groups.get('nt_spc_client', (0, 0))
                 
         # calculate and save the KPIs
         epay_kpi['std_client_num'] = std_client_num
@@ -249,15 +1767,23 @@ def generate_reports():
         else:
             epay_kpi['nt_spc_client_cpu_usage'] = 0
             epay_kpi['nt_spc_client_call_cost'] = 0
-            
-    # get the summary values for the final line
-    summarized_data = get_summarized_data(epay_kpi_list)
+    
+    return epay_kpi_list
 
 
+def print_epay_kpi_report(epay_kpi_list, summary = True, percentiles = None, window_size = None):
+    '''print the EPAY KPI report, the SUMMARY(AVERAGE) line is printed if summary is True, followed by the
+    lines of percentiles if they are given. window_size tells the KPIs are the rolling averages of the intervals.
+    '''
+            
     # print output title
-    print '\nEPAY SPA KPI report:'
+    if window_size:
+        print '\nEPAY SPA KPI report (rolling average of %d intervals):' % window_size
+    else:
+        print '\nEPAY SPA KPI report:'
 
     # setup output table
+    from prettytable import PrettyTable
     ptable = PrettyTable(['No', 'Report Time', 'TPS', 'STD #', 'STD %', 'STD Cost', 'CRT #', 'CRT %', 'CRT Cost', 'NTF #', 'NTF %', 'NTF Cost'])
     
     # add data into table
@@ -271,15 +1797,27 @@ def generate_reports():
                         item['nt_spc_client_num'], format(item['nt_spc_client_cpu_usage'], '.2f'), format(item['nt_spc_client_call_cost'], '.2f')
                         ])
 
-    ptable.add_row(['--','----------------', '-----', '-----', '------', '--------', '-----', '------', '--------', '-----', '------', '--------'])
-    ptable.add_row(['>', 'SUMMARY(AVERAGE)', format(summarized_data['tps(sum)'] / summarized_data['tps(cnt)'], 'd'), \
-                    '-', format(summarized_data['std_client_cpu_usage(sum)'] / summarized_data['std_client_cpu_usage(cnt)'], '.2f'), \
-                    format(summarized_data['std_client_call_cost(sum)'] / summarized_data['std_client_call_cost(cnt)'], '.2f'), \
-                    '-', format(summarized_data['cr_spc_client_cpu_usage(sum)'] / summarized_data['cr_spc_client_cpu_usage(cnt)'], '.2f'), \
-                    format(summarized_data['cr_spc_client_call_cost(sum)'] / summarized_data['cr_spc_client_call_cost(cnt)'], '.2f'), \
-                    '-', format(summarized_data['nt_spc_client_cpu_usage(sum)'] / summarized_data['nt_spc_client_cpu_usage(cnt)'], '.2f'), \
-                    format(summarized_data['nt_spc_client_call_cost(sum)'] / summarized_data['nt_spc_client_call_cost(cnt)'], '.2f'),
-                    ])
+    if summary:
+        
+        # get the summary values for the final line
+        summarized_data = get_summarized_data(epay_kpi_list)
+
+        ptable.add_row(['--','----------------', '-----', '-----', '------', '--------', '-----', '------', '--------', '-----', '------', '--------'])
+        ptable.add_row(['>', 'SUMMARY(AVERAGE)', format(summarized_data['tps(sum)'] / summarized_data['tps(cnt)'], 'd'), \
+                        '-', format(summarized_data['std_client_cpu_usage(sum)'] / summarized_data['std_client_cpu_usage(cnt)'], '.2f'), \
+                        format(summarized_data['std_client_call_cost(sum)'] / summarized_data['std_client_call_cost(cnt)'], '.2f'), \
+                        '-', format(summarized_data['cr_spc_client_cpu_usage(sum)'] / summarized_data['cr_spc_client_cpu_usage(cnt)'], '.2f'), \
+                        format(summarized_data['cr_spc_client_call_cost(sum)'] / summarized_data['cr_spc_client_call_cost(cnt)'], '.2f'), \
+                        '-', format(summarized_data['nt_spc_client_cpu_usage(sum)'] / summarized_data['nt_spc_client_cpu_usage(cnt)'], '.2f'), \
+                        format(summarized_data['nt_spc_client_call_cost(sum)'] / summarized_data['nt_spc_client_call_cost(cnt)'], '.2f'),
+                        ])
+        
+        for label, values in get_percentile_data(epay_kpi_list, epay_kpi_keys, percentiles or ()):
+            ptable.add_row(['>', 'SUMMARY(%s)' % label, format(int(round(values['tps'])), 'd'), \
+                            '-', format(values['std_client_cpu_usage'], '.2f'), format(values['std_client_call_cost'], '.2f'), \
+                            '-', format(values['cr_spc_client_cpu_usage'], '.2f'), format(values['cr_spc_client_call_cost'], '.2f'), \
+                            '-', format(values['nt_spc_client_cpu_usage'], '.2f'), format(values['nt_spc_client_call_cost'], '.2f')
+                            ])
     
     # format this table
     ptable.align = 'r'
@@ -290,55 +1828,70 @@ def generate_reports():
     return
 
 
-def generate_process_cpu_reports(process_name = 'MHRPROC', process_type = 0):
+def generate_reports():
+    '''this function reads information from meas_store then calculate the KPIs and print the report.'''
+    
+    print_epay_kpi_report(calc_epay_kpi_list())
+
+    return
+
+
+def get_process_matcher(process_name, process_type):
+    '''return a function which tells whether a process name in MS_PROCESS_MEAS table belongs to the specified
+    process, see generate_process_cpu_reports() for process_type. the pattern is compiled only once.
     '''
-    generate the report for specified process cpu usage.
-    process_name indicates the name of the process you want to collect, and process_type indicates the type of the process:
-    0 - Normal process, such as MHRPROC / TCPIPSCH
-    1 - SPA clients, such as EPAY28I_12 / EPPSA173_2
-    2 - RTDB process (RTDB: RPROC or NDB: APROCMATE), such as SIMDB28FRA / ACMDB104P03    
+    
+    if process_type == 0:
+        return lambda item_process_name: item_process_name == process_name
+    elif process_type == 1:
+        pattern = re.compile(process_name + r'.*_\d')
+        return lambda item_process_name: pattern.match(item_process_name) is not None
+    elif process_type == 2:
+        pattern = re.compile(process_name + r'.*[RP]\S')
+        return lambda item_process_name: pattern.match(item_process_name) is not None
+    else:
+        return lambda item_process_name: False
+
+
+def calc_process_cpu_report_list(process_name, process_type, report_times = None):
+    '''calculate the cpu usage of specified process for each role, return process_cpu_report_list.
+    only the specified report times are calculated if report_times is given.
+    see generate_process_cpu_reports() for process_name and process_type.
     '''
     
-    process_cpu_report_list = []
+    return calc_processes_cpu_report_lists([(process_name, process_type)], report_times)[0]
+
+
+def calc_processes_cpu_report_lists(process_specs, report_times = None):
+    '''calculate the cpu usage of each (process_name, process_type) in process_specs for each role,
+    return [process_cpu_report_list, ...] in the order of process_specs.
+    the rows of MS_PROCESS_MEAS table are classified against all the processes in a single pass.
+    '''
     
-    # build up basic structure
-    for item in MS_PROCESS_MEAS_infolist:
-        if {'report_time' : item['report_time']} not in process_cpu_report_list:
-            process_cpu_report_list.append({'report_time' : item['report_time']})
-            
-    #print process_cpu_report_list
+    # sum up the cpu usage of the processes for each role
+    processes_cpu = meas_store.aggregate_processes_cpu([get_process_matcher(process_name, process_type) \
+                                                        for process_name, process_type in process_specs],
+                                                       {'pilot' : 'pilot', 'io' : 'io', 'db1' : 'db', 'db2' : 'db'}, 'app',
+                                                       report_times)
     
-    # fill up KPIs
-    for process_cpu_report in process_cpu_report_list:
+    process_cpu_report_lists = []
+    for process_cpu in processes_cpu:
         
-        #print "calculate CPU usage for", process_name, "at",  process_cpu_report['report_time']
+        # build up basic structure
+        process_cpu_report_list = []
+        for report_time in meas_store.get_process_report_times():
+            if report_times is None or report_time in report_times:
+                process_cpu_report_list.append({'report_time' : report_time})
         
-        pilot_cnt = pilot_cpu = 0
-        db_cnt = db_cpu = 0
-        io_cnt = io_cpu = 0
-        app_cnt = app_cpu = 0
-        
-        # fill up KPIs for each time points
-        for item in MS_PROCESS_MEAS_infolist:
-            if process_cpu_report['report_time'] == item['report_time'] and \
-            ((process_type == 0 and item['process_name'] == process_name) or \
-            (process_type == 1 and re.match(process_name + r'.*_\d', item['process_name'])) or \
-            (process_type == 2 and re.match(process_name + r'.*[RP]\S', item['process_name']))) :
+        # fill up KPIs
+        for process_cpu_report in process_cpu_report_list:
+            
+            groups = process_cpu[process_cpu_report['report_time']]
+            pilot_cnt, pilot_cpu = groups.get('pilot', (0, 0))
+            db_cnt, db_cpu = groups.get('db', (0, 0))
+            io_cnt, io_cpu = groups.get('io', (0, 0))
+            app_cnt, app_cpu = groups.get('app', (0, 0))
             
-                # prepare cpu usage values for each role
-                if item['host_id'] in host_role_definition['pilot']:
-                    pilot_cnt += 1
-                    pilot_cpu += float(item['cpu_usage'])
-                elif item['host_id'] in host_role_definition['io']:
-                    io_cnt += 1
-                    io_cpu += float(item['cpu_usage'])
-                elif item['host_id'] in (host_role_definition['db1'] + host_role_definition['db2']):
-                    db_cnt += 1
-                    db_cpu += float(item['cpu_usage'])
-                else:
-                    app_cnt += 1
-                    app_cpu += float(item['cpu_usage'])
-        else:
             # calculate the average cpu usage
             process_cpu_report['pilot_cnt'] = pilot_cnt
             process_cpu_report['db_cnt'] = db_cnt
@@ -349,15 +1902,25 @@ def generate_process_cpu_reports(process_name = 'MHRPROC', process_type = 0):
             process_cpu_report['db_cpu'] = 0 if db_cnt == 0 else db_cpu / db_cnt
             process_cpu_report['io_cpu'] = 0 if io_cnt == 0 else io_cpu / io_cnt
             process_cpu_report['app_cpu'] = 0 if app_cnt == 0 else app_cpu / app_cnt
+        
+        process_cpu_report_lists.append(process_cpu_report_list)
+    
+    return process_cpu_report_lists
 
-    # get the summary values for the final line
-    summarized_data = get_summarized_data(process_cpu_report_list)
 
+def print_process_cpu_report(process_cpu_report_list, process_name, summary = True, percentiles = None, window_size = None):
+    '''print the process cpu usage report, the SUMMARY(AVERAGE) line is printed if summary is True, followed by
+    the lines of percentiles if they are given. window_size tells the cpu usage is the rolling average of the intervals.
+    '''
 
     # print output title
-    print '\nProcess CPU Usage Report:'
+    if window_size:
+        print '\nProcess CPU Usage Report (rolling average of %d intervals):' % window_size
+    else:
+        print '\nProcess CPU Usage Report:'
 
     # setup output table
+    from prettytable import PrettyTable
     ptable = PrettyTable(['No', 'Report Time', 'Process', 'PI #', 'PI %', 'DB #', 'DB %', 'IO #', 'IO %', 'AP #', 'AP %'])
     
     # add data into table
@@ -372,13 +1935,26 @@ def generate_process_cpu_reports(process_name = 'MHRPROC', process_type = 0):
                         item['app_cnt'], format(item['app_cpu'], '.2f')
                         ])
 
-    ptable.add_row(['--','----------------', '-------', '----', '------', '----', '------', '----', '------', '----', '------'])
-    ptable.add_row(['>', 'SUMMARY(AVERAGE)', process_name, \
-                    '-', format(summarized_data['pilot_cpu(sum)'] / summarized_data['pilot_cpu(cnt)'], '.2f'), \
-                    '-', format(summarized_data['db_cpu(sum)'] / summarized_data['db_cpu(cnt)'], '.2f'), \
-                    '-', format(summarized_data['io_cpu(sum)'] / summarized_data['io_cpu(cnt)'], '.2f'), \
-                    '-', format(summarized_data['app_cpu(sum)'] / summarized_data['app_cpu(cnt)'], '.2f')
-                    ])
+    if summary:
+        
+        # get the summary values for the final line
+        summarized_data = get_summarized_data(process_cpu_report_list)
+
+        ptable.add_row(['--','----------------', '-------', '----', '------', '----', '------', '----', '------', '----', '------'])
+        ptable.add_row(['>', 'SUMMARY(AVERAGE)', process_name, \
+                        '-', format(summarized_data['pilot_cpu(sum)'] / summarized_data['pilot_cpu(cnt)'], '.2f'), \
+                        '-', format(summarized_data['db_cpu(sum)'] / summarized_data['db_cpu(cnt)'], '.2f'), \
+                        '-', format(summarized_data['io_cpu(sum)'] / summarized_data['io_cpu(cnt)'], '.2f'), \
+                        '-', format(summarized_data['app_cpu(sum)'] / summarized_data['app_cpu(cnt)'], '.2f')
+                        ])
+        
+        for label, values in get_percentile_data(process_cpu_report_list, process_cpu_keys, percentiles or ()):
+            ptable.add_row(['>', 'SUMMARY(%s)' % label, process_name, \
+                            '-', format(values['pilot_cpu'], '.2f'), \
+                            '-', format(values['db_cpu'], '.2f'), \
+                            '-', format(values['io_cpu'], '.2f'), \
+                            '-', format(values['app_cpu'], '.2f')
+                            ])
     
     # format this table
     ptable.align = 'r'
@@ -387,44 +1963,64 @@ def generate_process_cpu_reports(process_name = 'MHRPROC', process_type = 0):
     print ptable
 
     return
+
+
+def generate_process_cpu_reports(process_name = 'MHRPROC', process_type = 0):
+    '''
+    generate the report for specified process cpu usage.
+    process_name indicates the name of the process you want to collect, and process_type indicates the type of the process:
+    0 - Normal process, such as MHRPROC / TCPIPSCH
+    1 - SPA clients, such as EPAY28I_12 / EPPSA173_2
+    2 - RTDB process (RTDB: RPROC or NDB: APROCMATE), such as SIMDB28FRA / ACMDB104P03    
+    '''
     
+    print_process_cpu_report(calc_process_cpu_report_list(process_name, process_type), process_name)
 
-def generate_hosts_overall_cpu_reports(*host_ids):
-    '''generate the report for specified hosts overall cpu usage.'''
+    return
+
+
+def generate_processes_cpu_reports(process_specs):
+    '''generate the reports for each (process_name, process_type) in process_specs, see generate_process_cpu_reports().'''
     
-    # check criteria
-    if host_ids == ():
-        print 'def generate_hosts_overall_cpu_reports(*host_ids) ...'
-        print 'host_ids should be specified. function returned directly.'
-        return
+    process_cpu_report_lists = calc_processes_cpu_report_lists(process_specs)
+    for (process_name, process_type), process_cpu_report_list in zip(process_specs, process_cpu_report_lists):
+        print_process_cpu_report(process_cpu_report_list, process_name)
+
+    return
+
+
+def calc_hosts_overall_cpu_report_list(host_ids, report_times = None):
+    '''collect the overall cpu usage of specified hosts, return hosts_overall_cpu_reports_list.
+    only the specified report times are collected if report_times is given.
+    '''
     
     hosts_overall_cpu_reports_list = []
     
     # build up basic structure
-    for item in MS_PERF_MEAS_infolist:
-        if {'report_time' : item['report_time']} not in hosts_overall_cpu_reports_list:
-            hosts_overall_cpu_reports_list.append({'report_time' : item['report_time']})
+    for report_time in meas_store.get_perf_report_times():
+        if report_times is None or report_time in report_times:
+            hosts_overall_cpu_reports_list.append({'report_time' : report_time})
     
     #print hosts_overall_cpu_reports_list
     
-    # fill up KPIs
+    # fill up overall cpu usage for each host_id
+    overall_cpu = meas_store.aggregate_overall_cpu(host_ids, report_times)
     for hosts_overall_cpu_reports in hosts_overall_cpu_reports_list:
-        
-        # fill up KPIs for each time points
-        for item in MS_PERF_MEAS_infolist:
-            if hosts_overall_cpu_reports['report_time'] == item['report_time']:
-                
-                # fill up overall cpu usage for each host_id
-                for host_id in host_ids:
-                    if host_id == item['host_id']:
-                        hosts_overall_cpu_reports[host_id] = item['overall_cpu_usage']
+        hosts_overall_cpu_reports.update(overall_cpu[hosts_overall_cpu_reports['report_time']])
                         
     #print hosts_overall_cpu_reports_list
+    
+    return hosts_overall_cpu_reports_list
+
+
+def print_hosts_overall_cpu_report(hosts_overall_cpu_reports_list, host_ids):
+    '''print the hosts overall cpu usage report.'''
 
     # print output title
     print '\nHosts Overall CPU Usage Report:'
 
     # setup output table
+    from prettytable import PrettyTable
     ptable = PrettyTable(['No', 'Report Time'] + list(host_ids))
     
     # add data into table
@@ -451,43 +2047,708 @@ def generate_hosts_overall_cpu_reports(*host_ids):
     return
 
 
-def main():
-    '''check input parameters, load the meanslog file'''
+def generate_hosts_overall_cpu_reports(*host_ids):
+    '''generate the report for specified hosts overall cpu usage.'''
     
-    if len(sys.argv) < 2:
-        print 'Usage: calcmeas.py <measlog file>'
+    # check criteria
+    if host_ids == ():
+        print 'def generate_hosts_overall_cpu_reports(*host_ids) ...'
+        print 'host_ids should be specified. function returned directly.'
         return
-    else:
-        print "Measurement log file: ", sys.argv[1]
+    
+    print_hosts_overall_cpu_report(calc_hosts_overall_cpu_report_list(host_ids), host_ids)
+
+    return
+
+
+# the reports generated by main()
+report_host_ids = ('0-0-1', '0-0-9', '0-0-2', '0-0-10', '0-0-5')
+report_processes = (('MHRPROC', 0), ('EPAY', 1), ('ACM', 2), ('SIM', 2), ('SHRTDB', 2))
+
+# (report name, the tables it is calculated from), the report names are the subcommands of main()
+report_definition = (('hosts', ('MS_PERF_MEAS',)),
+                     ('epay', ('SA_SPAMEAS', 'MS_PROCESS_MEAS')),
+                     ('process', ('MS_PROCESS_MEAS',))
+                     )
+report_names = tuple([report_name for report_name, table_names in report_definition])
+report_table_names = dict(report_definition)
+
+
+def get_report_host_ids(meas_filter = None):
+    '''return the hosts of the hosts overall CPU usage report: the ones of report_host_ids accepted by
+    meas_filter, then the other hosts given to meas_filter and the hosts of the roles given to meas_filter.
+    '''
+    
+    if meas_filter is None or not meas_filter.is_host_filtered():
+        return report_host_ids
+    
+    host_ids = [host_id for host_id in report_host_ids if meas_filter.accept_host(host_id)]
+    role_host_ids = []
+    for role in sorted(meas_filter.roles or ()):
+        role_host_ids.extend(host_role_definition.get(role, ()))
+    for host_id in list(meas_filter.host_ids or ()) + role_host_ids:
+        if host_id not in host_ids:
+            host_ids.append(host_id)
+    
+    return tuple(host_ids)
+
+
+def generate_updated_reports(report_times, host_ids = report_host_ids, reports = report_names):
+    '''print the rows of the specified report times in each of reports, used to show the updates of the measlog.'''
+    
+    if 'hosts' in reports:
+        hosts_overall_cpu_reports_list = calc_hosts_overall_cpu_report_list(host_ids, report_times)
+        if host_ids and hosts_overall_cpu_reports_list:
+            print_hosts_overall_cpu_report(hosts_overall_cpu_reports_list, host_ids)
+    
+    if 'epay' in reports:
+        epay_kpi_list = calc_epay_kpi_list(report_times)
+        if epay_kpi_list:
+            print_epay_kpi_report(epay_kpi_list, False)
+    
+    process_cpu_report_lists = []
+    if 'process' in reports:
+        process_cpu_report_lists = calc_processes_cpu_report_lists(report_processes, report_times)
+    for (process_name, process_type), process_cpu_report_list in zip(report_processes, process_cpu_report_lists):
+        if process_cpu_report_list:
+            print_process_cpu_report(process_cpu_report_list, process_name, False)
+
+    return
+
+
+def analyze_measlog_tail(path, offset, report_times, meas_filter = None):
+    '''parse the blocks appended to the measlog file after offset, and save the ones accepted by meas_filter
+    into meas_store. the report times of the saved blocks are added into report_times.
+    return the offset after the last '++-' line, the block not finished yet is parsed again next time.
+    '''
+    
+    parser = MeasBlockParser(meas_filter)
+    f = open(path, 'rb')
+    try:
+        f.seek(offset)
+        position = offset
+        while True:
+            line = f.readline()
+            
+            # stop at the line still being written
+            if not line.endswith('\n'):
+                break
+            position += len(line)
+            
+            block = parser.feed_line(line)
+            if block is not None:
+                table_name, report_time, rows = block
+                save_block(table_name, report_time, rows)
+                if report_time not in report_times:
+                    report_times.append(report_time)
+            
+            # the parser is out of any block after a '++-' line, it is safe to continue from here
+            if block_end_literal in line:
+                offset = position
+    finally:
+        f.close()
+    
+    return offset
+
+
+def follow_measlog(path, interval, meas_filter = None, reports = report_names):
+    '''keep following the measlog file which is still being written. every interval seconds the blocks
+    appended since the last time are parsed, and the report rows of their report times are printed for
+    each of reports. only the measurements accepted by meas_filter are saved.
+    '''
+    
+    global meas_store
+    
+    offset = 0
+    while True:
+        
+        # the measlog is rotated or truncated, start over
+        if os.path.getsize(path) < offset:
+            print 'Measurement log file is truncated, restart from the beginning: ', path
+            meas_store = meas_store.__class__()
+            offset = 0
+        
+        report_times = []
+        offset = analyze_measlog_tail(path, offset, report_times, meas_filter)
+        
+        if report_times:
+            print '\nUpdated Reports at', time.strftime('%Y-%m-%d %H:%M:%S'), '\n', '=' * 60
+            generate_updated_reports(report_times, get_report_host_ids(meas_filter), reports)
+            # the output is often piped, e.g. to tee or less, show the updated reports now
+            sys.stdout.flush()
+        
+        time.sleep(interval)
+
+
+# the columns of the exported reports, (name, typecode): 's' for strings, 'i' for integers and 'd' for floats
+report_export_columns = {'hosts_overall_cpu' : (('report_time', 's'), ('host_id', 's'), ('overall_cpu_usage', 'i')),
+                         'epay_kpi' : (('report_time', 's'), ('tps', 'i'),
+                                       ('std_client_num', 'i'), ('std_client_cpu_usage', 'd'), ('std_client_call_cost', 'd'),
+                                       ('cr_spc_client_num', 'i'), ('cr_spc_client_cpu_usage', 'd'), ('cr_spc_client_call_cost', 'd'),
+                                       ('nt_spc_client_num', 'i'), ('nt_spc_client_cpu_usage', 'd'), ('nt_spc_client_call_cost', 'd')),
+                         'process_cpu' : (('process_name', 's'), ('report_time', 's'),
+                                          ('pilot_cnt', 'i'), ('pilot_cpu', 'd'), ('db_cnt', 'i'), ('db_cpu', 'd'),
+                                          ('io_cnt', 'i'), ('io_cpu', 'd'), ('app_cnt', 'i'), ('app_cpu', 'd'))}
+
+report_export_buffer_size = 1024 * 1024
+report_export_formats = ('csv', 'jsonl', 'columnar')
+report_export_suffixes = {'csv' : '.csv', 'jsonl' : '.jsonl', 'columnar' : '.cmcol'}
+report_columnar_magic = 'CALCMEAS-COLUMNS 1\n'
+
+
+class CsvReportWriter(object):
+    '''write the rows of a report as CSV with a header line, the rows are written as soon as they are received.'''
+    
+    def __init__(self, path, columns):
+        import csv
+        self.f = open(path, 'wb', report_export_buffer_size)
+        self.writer = csv.writer(self.f)
+        self.writer.writerow([name for name, typecode in columns])
+    
+    def write_row(self, row):
+        self.writer.writerow(row)
+    
+    def close(self):
+        self.f.close()
+
+
+class JsonlReportWriter(object):
+    '''write the rows of a report as JSON Lines, one object per row with the keys in the order of columns.'''
+    
+    def __init__(self, path, columns):
+        self.f = open(path, 'wb', report_export_buffer_size)
+        self.keys = [json.dumps(name) + ': ' for name, typecode in columns]
+    
+    def write_row(self, row):
+        self.f.write('{' + ', '.join([key + json.dumps(value) for key, value in zip(self.keys, row)]) + '}\n')
+    
+    def close(self):
+        self.f.close()
+
+
+class ColumnarReportWriter(object):
+    '''write the rows of a report as typed arrays, one array per column:
+    1. magic line
+    2. json header: byte order, number of rows, (name, typecode, itemsize) of the columns, the strings of the
+       string columns
+    3. the arrays in the order of columns, in the machine byte order. the string columns are saved as 'i'
+       arrays of the codes of the strings.
+    see load_columnar_report().
+    '''
+    
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.arrays = []
+        self.strings = {}
+        self.string_codes = {}
+        for name, typecode in columns:
+            self.arrays.append(array(typecode == 's' and 'i' or typecode))
+            if typecode == 's':
+                self.strings[name] = []
+                self.string_codes[name] = {}
+    
+    def write_row(self, row):
+        for index in xrange(len(self.columns)):
+            name, typecode = self.columns[index]
+            value = row[index]
+            if typecode == 's':
+                codes = self.string_codes[name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(self.strings[name])
+                    self.strings[name].append(value)
+                value = code
+            self.arrays[index].append(value)
+    
+    def close(self):
+        header = {}
+        header['byteorder'] = sys.byteorder
+        header['rows'] = len(self.arrays[0])
+        header['columns'] = [(name, typecode, column.itemsize) for (name, typecode), column in zip(self.columns, self.arrays)]
+        header['strings'] = self.strings
+        
+        f = open(self.path, 'wb', report_export_buffer_size)
+        try:
+            f.write(report_columnar_magic)
+            f.write(json.dumps(header) + '\n')
+            for column in self.arrays:
+                column.tofile(f)
+        finally:
+            f.close()
+
+
+report_export_writers = {'csv' : CsvReportWriter, 'jsonl' : JsonlReportWriter, 'columnar' : ColumnarReportWriter}
+
+
+def load_columnar_report(path):
+    '''load a report exported in the columnar format, return {column name: list of values}.'''
+    
+    f = open(path, 'rb')
+    try:
+        if f.readline() != report_columnar_magic:
+            raise ValueError('not a columnar report file: %s' % path)
+        header = json.loads(f.readline())
         
-        # read measlog file
-        f = open(sys.argv[1], 'r')
-        measlog = f.readlines()
+        report = {}
+        for name, typecode, itemsize in header['columns']:
+            column = array(typecode == 's' and 'i' or str(typecode))
+            if column.itemsize != itemsize:
+                raise ValueError('the item size of column %s is %d, %d expected' % (name, itemsize, column.itemsize))
+            column.fromfile(f, header['rows'])
+            if header['byteorder'] != sys.byteorder:
+                column.byteswap()
+            if typecode == 's':
+                strings = [str(value) for value in header['strings'][name]]
+                report[str(name)] = [strings[code] for code in column]
+            else:
+                report[str(name)] = column.tolist()
+    finally:
         f.close()
+    
+    return report
+
+
+def iter_report_export_rows(report_name, report_list, names = None):
+    '''yield the rows of the report list in the order of report_export_columns[report_name].
+    names are the host ids of hosts_overall_cpu report, or the process names of process_cpu report, whose
+    report_list is a list of process_cpu_report_list.
+    '''
+    
+    if report_name == 'hosts_overall_cpu':
+        for item in report_list:
+            for host_id in names:
+                if host_id in item:
+                    yield (item['report_time'], host_id, item[host_id])
+    elif report_name == 'process_cpu':
+        keys = [name for name, typecode in report_export_columns[report_name][1:]]
+        for process_name, process_cpu_report_list in zip(names, report_list):
+            for item in process_cpu_report_list:
+                yield (process_name,) + tuple([item[key] for key in keys])
+    else:
+        keys = [name for name, typecode in report_export_columns[report_name]]
+        for item in report_list:
+            yield tuple([item[key] for key in keys])
 
-    # analyze the measurement log
-    analyze_measlog(measlog)
+
+def export_report(directory, export_format, report_name, report_list, names = None):
+    '''write the report into <directory>/<report_name><suffix of export_format>, return the path and the
+    number of rows.
+    '''
+    
+    path = os.path.join(directory, report_name + report_export_suffixes[export_format])
+    writer = report_export_writers[export_format](path, report_export_columns[report_name])
+    row_num = 0
+    try:
+        for row in iter_report_export_rows(report_name, report_list, names):
+            writer.write_row(row)
+            row_num += 1
+    finally:
+        writer.close()
+    
+    return path, row_num
 
 
-    print '\nGenerate Reports\n', '=' * 60
+def get_peak_rss(children = False):
+    '''return the peak resident set size in MB of this process, or of the largest finished worker process if
+    children is True. None if it is not available on this platform.
+    '''
+    
+    if resource is None:
+        return None
+    if children:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    # ru_maxrss is in bytes on Mac OS X, in KB on Linux
+    if sys.platform == 'darwin':
+        return round(peak / 1048576.0, 1)
+    return round(peak / 1024.0, 1)
+
+
+class RunStats(object):
+    '''this class records the wall time, the counters and the memory of each stage of a run:
+    1. read: only if read_files is True, the measlog files are read once without parsing to tell the I/O time
+       apart from the parse time. note it doubles the I/O and warms the page cache for the parse stage.
+    2. parse: the measlog files are parsed into meas_store
+    3. aggregation: the KPIs of the reports are calculated
+    4. rendering: the report tables are printed
+    the peak resident set size of the process only grows, so each stage records it as peak_rss_cumulative_mb,
+    and the growth of it during the stage as peak_rss_growth_mb.
+    the summary is saved as JSON by --stats.
+    '''
+    
+    def __init__(self, read_files = False):
+        self.read_files = read_files
+        self.start_time = time.time()
+        self.stages = []
+        self.stage_start_time = None
+        self.stage_start_rss = None
+    
+    def begin(self, stage_name):
+        self.stages.append({'stage' : stage_name})
+        self.stage_start_time = time.time()
+        self.stage_start_rss = get_peak_rss()
+    
+    def end(self, **counters):
+        stage = self.stages[-1]
+        stage['wall_time'] = round(time.time() - self.stage_start_time, 6)
+        stage['peak_rss_cumulative_mb'] = get_peak_rss()
+        stage['peak_rss_growth_mb'] = None
+        if stage['peak_rss_cumulative_mb'] is not None:
+            stage['peak_rss_growth_mb'] = round(stage['peak_rss_cumulative_mb'] - self.stage_start_rss, 1)
+        stage.update(counters)
+    
+    def get_summary(self):
+        return {'argv' : sys.argv[1:],
+                'wall_time' : round(time.time() - self.start_time, 6),
+                'peak_rss_mb' : get_peak_rss(),
+                'peak_rss_children_mb' : get_peak_rss(True),
+                'stages' : self.stages}
+    
+    def save(self, path):
+        f = open(path, 'w')
+        try:
+            json.dump(self.get_summary(), f, indent = 2, sort_keys = True)
+            f.write('\n')
+        finally:
+            f.close()
+
 
-    # generate hosts overall CPU usage
-    generate_hosts_overall_cpu_reports('0-0-1', '0-0-9', '0-0-2', '0-0-10', '0-0-5')
+def count_measlog_lines(path, read_size = 1024 * 1024):
+    '''read the measlog file in read_size pieces, return (number of bytes, number of lines) of the content,
+    the compressed file is decompressed.
+    '''
+    
+    byte_num = line_num = 0
+    for data in iter_measlog_data(path, read_size):
+        byte_num += len(data)
+        line_num += data.count('\n')
     
-    # generate EPAY reports
-    generate_reports()
+    return byte_num, line_num
 
-    # generate process CPU usage
-    generate_process_cpu_reports()
-    #generate_process_cpu_reports('asd')
-    #generate_process_cpu_reports('APROC')
-    generate_process_cpu_reports('EPAY', 1)
-    generate_process_cpu_reports('ACM', 2)
-    generate_process_cpu_reports('SIM', 2)
-    generate_process_cpu_reports('SHRTDB', 2)
+
+def run_reports(paths, jobs = 1, chunk_size = 64 * 1024 * 1024, use_cache = False, run_stats = None, meas_filter = None,
+                percentiles = None, window_size = None, export_directory = None, export_formats = (), table = True,
+                warehouse = None, reports = report_names):
+    '''analyze the measlog files and print the reports of report_names in reports, see main(). the stages are recorded into run_stats
+    if it is given. only the measurements accepted by meas_filter are analyzed, the empty reports are not printed.
+    the EPAY and process CPU tables show the rolling averages of window_size intervals if it is given, and
+    the percentile lines if percentiles is given.
+    the reports are exported into export_directory in each of export_formats with the values of each interval,
+    and they are printed as tables only if table is True.
+    the analyzed measurements are loaded into the warehouse database if it is given.
+    '''
+    
+    if run_stats is None:
+        run_stats = RunStats()
+    elif run_stats.read_files:
+        # read the files without parsing them, only when it is asked by --stats-read
+        run_stats.begin('read')
+        byte_num = line_num = 0
+        measlog_files = list_measlog_files(paths)
+        for path in measlog_files:
+            file_byte_num, file_line_num = count_measlog_lines(path)
+            byte_num += file_byte_num
+            line_num += file_line_num
+        run_stats.end(files = len(measlog_files), bytes = byte_num, lines = line_num)
+    
+    # analyze the measurement logs
+    run_stats.begin('parse')
+    analyze_measlog_files(paths, jobs, chunk_size, use_cache, meas_filter)
+    measlog_files = list_measlog_files(paths)
+    run_stats.end(files = len(measlog_files),
+                  file_bytes = sum([os.path.getsize(path) for path in measlog_files if os.path.isfile(path)]),
+                  rows = meas_store.get_row_counts(),
+                  report_times = {'SA_SPAMEAS' : len(set([report_time for report_time, spa_name, tps in meas_store.get_spa_meas()])),
+                                  'MS_PROCESS_MEAS' : len(meas_store.get_process_report_times()),
+                                  'MS_PERF_MEAS' : len(meas_store.get_perf_report_times())})
+    
+    if warehouse is not None:
+        run_stats.begin('warehouse')
+        row_num = save_warehouse(warehouse, meas_store)
+        print 'Loaded %d rows into measurement warehouse %s' % (row_num, warehouse)
+        run_stats.end(rows = row_num)
+    
+    # calculate the KPIs of hosts overall CPU usage, EPAY and process CPU usage
+    run_stats.begin('aggregation')
+    host_ids = get_report_host_ids(meas_filter)
+    hosts_overall_cpu_reports_list = epay_kpi_list = process_cpu_report_lists = []
+    if 'hosts' in reports:
+        hosts_overall_cpu_reports_list = calc_hosts_overall_cpu_report_list(host_ids)
+    if 'epay' in reports:
+        epay_kpi_list = calc_epay_kpi_list()
+    if 'process' in reports:
+        process_cpu_report_lists = calc_processes_cpu_report_lists(report_processes)
+    # the exports keep the values of each interval, only the tables show the rolling averages
+    table_epay_kpi_list, table_process_cpu_report_lists = epay_kpi_list, process_cpu_report_lists
+    if window_size:
+        table_epay_kpi_list = get_rolling_report_list(epay_kpi_list, epay_kpi_keys, window_size, ('tps',))
+        table_process_cpu_report_lists = [get_rolling_report_list(process_cpu_report_list, process_cpu_keys, window_size) \
+                                          for process_cpu_report_list in process_cpu_report_lists]
+    run_stats.end(report_rows = {'hosts_overall_cpu' : len(hosts_overall_cpu_reports_list),
+                                 'epay_kpi' : len(epay_kpi_list),
+                                 'process_cpu' : sum([len(report_list) for report_list in process_cpu_report_lists])})
+    
+    if export_directory is not None:
+        run_stats.begin('export')
+        if not os.path.isdir(export_directory):
+            os.makedirs(export_directory)
+        
+        print '\nExport Reports\n', '=' * 60
+        export_row_num = 0
+        for export_format in export_formats:
+            for report, report_name, report_list, names in (('hosts', 'hosts_overall_cpu', hosts_overall_cpu_reports_list, host_ids),
+                                                            ('epay', 'epay_kpi', epay_kpi_list, None),
+                                                            ('process', 'process_cpu', process_cpu_report_lists,
+                                                             [process_name for process_name, process_type in report_processes])):
+                if report not in reports:
+                    continue
+                path, row_num = export_report(export_directory, export_format, report_name, report_list, names)
+                export_row_num += row_num
+                print 'Exported %d rows into %s' % (row_num, path)
+        run_stats.end(formats = list(export_formats), rows = export_row_num)
+    
+    if not table:
+        print '\n', '=' * 60
+        print 'Finished!'
+        return
+    
+    run_stats.begin('rendering')
+    print '\nGenerate Reports\n', '=' * 60
+    
+    report_num = 0
+    if host_ids and hosts_overall_cpu_reports_list:
+        print_hosts_overall_cpu_report(hosts_overall_cpu_reports_list, host_ids)
+        report_num += 1
+    if table_epay_kpi_list:
+        print_epay_kpi_report(table_epay_kpi_list, True, percentiles, window_size)
+        report_num += 1
+    for (process_name, process_type), process_cpu_report_list in zip(report_processes, table_process_cpu_report_lists):
+        if process_cpu_report_list:
+            print_process_cpu_report(process_cpu_report_list, process_name, True, percentiles, window_size)
+            report_num += 1
     
     print '\n', '=' * 60
     print 'Finished!'
+    run_stats.end(reports = report_num)
+    
+    return
+
+
+# the bounds of --from and --to, a prefix of 'YYYY-MM-DD hh:mm'
+report_time_bound_pattern = re.compile(r'\d{4}(-\d{2}(-\d{2}( \d{2}(:\d{2})?)?)?)?$')
+
+
+def get_meas_filter(options):
+    '''build the MeasFilter of --from, --to, --host, --role and --table options.
+    return None if no filter is given, False if the options are wrong.
+    '''
+    
+    for option, value in (('--from', options.time_from), ('--to', options.time_to)):
+        if value is not None and not report_time_bound_pattern.match(value):
+            print "Error: %s should be 'YYYY-MM-DD hh:mm' or a prefix of it: %s" % (option, value)
+            return False
+    
+    host_ids = roles = None
+    if options.host:
+        host_ids = []
+        for value in options.host:
+            host_ids.extend([host_id.strip() for host_id in value.split(',') if host_id.strip()])
+    if options.role:
+        roles = []
+        for value in options.role:
+            roles.extend([role.strip() for role in value.split(',') if role.strip()])
+        for role in roles:
+            if role != 'app' and role not in host_topology.role_codes:
+                print 'Error: unknown role %s, the roles are %s and app.' % (role, ', '.join(host_topology.roles[1:]))
+                return False
+    
+    tables = None
+    if options.tables:
+        tables = []
+        for value in options.tables:
+            tables.extend([table_name.strip() for table_name in value.split(',') if table_name.strip()])
+        for table_name in tables:
+            if table_name not in measlog_row_parsers:
+                print 'Error: unknown table %s, the tables are %s.' % \
+                      (table_name, ', '.join([item_table_name for item_table_name, marker, row_parser in measlog_table_definition]))
+                return False
+    
+    if options.time_from is None and options.time_to is None and host_ids is None and roles is None and tables is None:
+        return None
+    
+    return MeasFilter(options.time_from, options.time_to, host_ids, roles, tables)
+
+
+def main():
+    '''check input parameters, load the meanslog file'''
+    
+    global meas_store
+    
+    parser = OptionParser(usage = 'Usage: calcmeas.py [%s] [options] <measlog file or directory> ...\n' \
+                                  '       calcmeas.py [%s] [options] --db <warehouse file>\n\n' \
+                                  'All the reports are generated unless one of them is given, then only its tables are parsed.' % \
+                                  (('|'.join(report_names),) * 2))
+    parser.add_option('--columnar', action = 'store_true', default = False,
+                      help = 'keep the measurements in typed arrays, the KPIs are calculated with numpy if it is installed')
+    parser.add_option('-j', '--jobs', type = 'int', default = 1,
+                      help = 'number of worker processes to parse the measlog files, 0 means one per CPU')
+    parser.add_option('--chunk-size', type = 'int', default = 64,
+                      help = 'size in MB of the chunks the measlog files are split into for the worker processes')
+    parser.add_option('--cache', action = 'store_true', default = False,
+                      help = 'load the parsed tables from <measlog file>%s, the cache file is rebuilt when the measlog file is changed' % measlog_cache_suffix)
+    parser.add_option('-f', '--follow', action = 'store_true', default = False,
+                      help = 'keep following the measlog file and print the report rows of the appended blocks')
+    parser.add_option('--interval', type = 'int', default = 900,
+                      help = 'seconds between two checks of the measlog file in --follow mode')
+    parser.add_option('--from', dest = 'time_from', metavar = 'TIME',
+                      help = "analyze only the blocks reported at or after TIME, 'YYYY-MM-DD hh:mm' or a prefix of it")
+    parser.add_option('--to', dest = 'time_to', metavar = 'TIME',
+                      help = "analyze only the blocks reported at or before TIME, 'YYYY-MM-DD' includes the whole day")
+    parser.add_option('--host', action = 'append', metavar = 'HOST_ID[,HOST_ID...]',
+                      help = 'analyze only the processes and the overall CPU usage of these hosts, may be repeated')
+    parser.add_option('--role', action = 'append', metavar = 'ROLE[,ROLE...]',
+                      help = "analyze only the hosts of these roles in the topology, 'app' for the other hosts")
+    parser.add_option('--table', dest = 'tables', action = 'append', metavar = 'TABLE[,TABLE...]',
+                      help = 'parse only the blocks of these tables, %s' % \
+                             ', '.join([table_name for table_name, marker, row_parser in measlog_table_definition]))
+    parser.add_option('--topology', metavar = 'FILE',
+                      help = 'load the roles of the hosts from the [roles] section of FILE instead of host_role_definition')
+    parser.add_option('--percentiles', action = 'store_true', default = False,
+                      help = 'print the %s lines after SUMMARY(AVERAGE) in the EPAY and process CPU reports' % \
+                             ', '.join([percentile == 100 and 'MAX' or 'P%d' % percentile for percentile in report_percentiles]))
+    parser.add_option('--window', type = 'int', metavar = 'N',
+                      help = 'show the rolling averages of the last N intervals in the EPAY and process CPU tables, '
+                             'the exports keep the values of each interval')
+    parser.add_option('--export', metavar = 'DIR',
+                      help = 'export the hosts overall CPU, EPAY KPI and process CPU reports into DIR')
+    parser.add_option('--export-format', default = 'csv', metavar = 'FORMAT[,FORMAT...]',
+                      help = 'formats of --export: %s, default csv' % ', '.join(report_export_formats))
+    parser.add_option('--no-table', dest = 'table', action = 'store_false', default = True,
+                      help = 'do not print the reports as tables, e.g. when they are only exported')
+    parser.add_option('--db', metavar = 'FILE',
+                      help = 'load the measurements into the SQLite warehouse FILE, the reports are generated from FILE if no measlog is given')
+    parser.add_option('--stats', metavar = 'FILE',
+                      help = 'save the wall time, line and row counts and peak memory of each stage into FILE as JSON')
+    parser.add_option('--stats-read', action = 'store_true', default = False,
+                      help = 'add a stage to --stats reading the measlog files once before parsing them, ' \
+                             'the lines are counted but the I/O is doubled')
+    parser.add_option('--profile', metavar = 'FILE',
+                      help = 'run under cProfile and save the profile data into FILE, see the pstats module')
+    options, args = parser.parse_args()
+    
+    # the report subcommand is the first argument, it parses only the tables of its report unless --table is given
+    reports = report_names
+    if args and args[0] in report_names:
+        reports = (args.pop(0),)
+        if not options.tables:
+            options.tables = list(report_table_names[reports[0]])
+    
+    if options.topology:
+        try:
+            load_host_topology(options.topology)
+        except ValueError, e:
+            print 'Error:', e
+            return
+    
+    if len(args) < 1 and not options.db:
+        parser.print_usage()
+        return
+    
+    if options.follow and not args:
+        print 'Error: --follow needs the measlog file.'
+        return
+    
+    if options.follow and (len(args) > 1 or os.path.isdir(args[0])):
+        print 'Error: --follow supports only one measlog file.'
+        return
+    
+    if options.follow and get_measlog_compression(args[0]) is not None:
+        print 'Error: --follow does not support the compressed measlog file.'
+        return
+    
+    if options.follow and (options.stats or options.profile or options.percentiles or options.window):
+        print 'Error: --stats, --profile, --percentiles and --window are not supported in --follow mode.'
+        return
+    
+    if options.stats_read and not options.stats:
+        print 'Error: --stats-read needs --stats.'
+        return
+    
+    export_formats = [export_format.strip() for export_format in options.export_format.split(',') if export_format.strip()]
+    for export_format in export_formats:
+        if export_format not in report_export_formats:
+            print 'Error: unknown export format %s, the formats are %s.' % (export_format, ', '.join(report_export_formats))
+            return
+    
+    if options.follow and (options.export or not options.table or options.db):
+        print 'Error: --export, --no-table and --db are not supported in --follow mode.'
+        return
+    
+    if options.window is not None and options.window < 1:
+        print 'Error: --window should be at least 1.'
+        return
+    
+    if options.jobs < 0:
+        print 'Error: --jobs should be at least 0.'
+        return
+    
+    if options.chunk_size < 1:
+        print 'Error: --chunk-size should be at least 1.'
+        return
+    
+    percentiles = None
+    if options.percentiles:
+        percentiles = report_percentiles
+    
+    meas_filter = get_meas_filter(options)
+    if meas_filter is False:
+        return
+    
+    if options.columnar:
+        meas_store = ColumnarMeasStore()
+    
+    # generate the reports from the warehouse, no measlog is analyzed
+    warehouse = options.db
+    if not args:
+        print 'Measurement warehouse: ', options.db
+        meas_store = WarehouseMeasStore(options.db, meas_filter)
+        warehouse = None
+    
+    if options.follow:
+        print "Measurement log file: ", args[0]
+        try:
+            follow_measlog(args[0], options.interval, meas_filter, reports)
+        except KeyboardInterrupt:
+            print '\nFinished!'
+        return
+    
+    jobs = options.jobs
+    if jobs == 0:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+        
+    run_stats = None
+    if options.stats:
+        run_stats = RunStats(options.stats_read)
+    
+    # analyze the measurement logs and print the reports
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(run_reports, args, jobs, options.chunk_size * 1024 * 1024, options.cache, run_stats, meas_filter,
+                             percentiles, options.window, options.export, export_formats, options.table, warehouse, reports)
+        finally:
+            profiler.dump_stats(options.profile)
+    else:
+        run_reports(args, jobs, options.chunk_size * 1024 * 1024, options.cache, run_stats, meas_filter,
+                    percentiles, options.window, options.export, export_formats, options.table, warehouse, reports)
+    
+    if run_stats is not None:
+        run_stats.save(options.stats)
     
     return
 
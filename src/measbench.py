@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+'''
+Benchmark of calcmeas.py on a synthetic measlog.
+'''
+
+import sys
+import os
+import re
+import time
+import random
+import tempfile
+from optparse import OptionParser
+
+import calcmeas
+
+
+# the application blades besides the ones in host_role_definition
+app_host_ids = ('0-0-5', '0-0-6', '0-0-7', '0-0-8', '0-0-13', '0-0-14', '0-0-15', '0-0-16')
+
+# the processes running on each host, the EPAY clients are the ones of 'EPAY28I' SPA
+process_names = ('MHRPROC', 'TCPIPSCH', 'EPAY28I_1', 'EPAY28I_2', 'EPAY28I_3', 'ACMDB104P03', 'SIMDB28FRA',
+                 'SHRTDBRP', 'DIAMCL28I_2', 'APROCMATE')
+
+
+def get_synthetic_host_ids(host_num = None):
+    '''return the host ids of the synthetic measlog: the hosts of host_role_definition first, then the application
+    blades. more application blades are added if host_num is larger, all the hosts are returned if host_num is None.
+    '''
+
+    host_ids = []
+    for role in sorted(calcmeas.host_role_definition.keys()):
+        host_ids.extend(calcmeas.host_role_definition[role])
+    host_ids.extend(app_host_ids)
+
+    if host_num is None:
+        return host_ids
+    blade = 1
+    while len(host_ids) < host_num:
+        host_ids.append('0-2-%d' % blade)
+        blade += 1
+    return host_ids[:host_num]
+
+
+def get_synthetic_process_names(process_num = None):
+    '''return the processes running on each host, more processes are added if process_num is larger.'''
+
+    names = list(process_names)
+    if process_num is None:
+        return names
+    while len(names) < process_num:
+        names.append('APPPROC%02d' % len(names))
+    return names[:process_num]
+
+
+def write_synthetic_measlog(f, intervals = 96, noise_tables = 4, seed = 0, host_num = None, process_num = None):
+    '''write a measlog with SA_SPAMEAS, MS_PROCESS_MEAS and MS_PERF_MEAS blocks for each 15 minutes interval,
+    noise_tables blocks of other tables are written before each of them.
+    host_num hosts with process_num processes each are written, see get_synthetic_host_ids().
+    '''
+
+    rand = random.Random(seed)
+    host_ids = get_synthetic_host_ids(host_num)
+    host_processes = get_synthetic_process_names(process_num)
+
+    sequence = [0]
+
+    def write_block(report_time, title, lines):
+        sequence[0] += 1
+        f.write('\n+++ FE01 %s:05 MEAS #%06d >\nREPT MEAS\n    %s\n' % (report_time, sequence[0], title))
+        f.write(''.join(lines))
+        f.write('++-\n')
+
+    def write_noise(report_time):
+        for table in range(noise_tables):
+            write_block(report_time, 'Measurements for XX_NOISE%d table' % table,
+                        ['  %d  NOISE%d  %d  %d  %.2f\n' % (row, table, rand.randint(0, 999), row, rand.uniform(0, 99)) \
+                         for row in range(len(host_ids))])
+
+    for interval in range(intervals):
+        report_time = time.strftime('%Y-%m-%d %H:%M', time.gmtime(1457308800 + interval * 900))
+
+        write_noise(report_time)
+        write_block(report_time, 'SPA Measurements for SA_SPAMEAS table',
+                    ['  INTERVAL SPA CALLS ERR\n',
+                     '  900  EPAY28I  %d  0\n' % rand.randint(10000, 90000),
+                     '  900  DIAMCL28I  %d  0\n' % rand.randint(1000, 9000)])
+
+        write_noise(report_time)
+        lines = []
+        for host_id in host_ids:
+            for process_name in host_processes:
+                lines.append('  299  %s   %s   %.2f\n' % (host_id, process_name, rand.uniform(0, 60)))
+        write_block(report_time, 'Process Measurements for MS_PROCESS_MEAS table', lines)
+
+        write_noise(report_time)
+        write_block(report_time, 'Control Computer Performance Measurements for MS_PERF_MEAS table',
+                    ['          299  %s              1             0              0          %d\n' % \
+                     (host_id, rand.randint(10, 99)) for host_id in host_ids])
+
+
+def legacy_analyze_measlog(measlog):
+    '''the parser before the streaming parser, kept as the reference of the benchmark:
+    three uncompiled re.search() for each line, back-scanning to the '+++' line for each table.
+    '''
+
+    tables = {'SA_SPAMEAS' : [], 'MS_PROCESS_MEAS' : [], 'MS_PERF_MEAS' : []}
+
+    def get_block_info(num):
+        begin = end = num
+        while re.search(r'\+\+\+', measlog[begin]) is None:
+            begin -= 1
+        while re.search(r'\+\+\-', measlog[end]) is None:
+            end += 1
+        match_result = re.search(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2})', measlog[begin])
+        return (begin, end, match_result.group(1))
+
+    num = 0
+    while num < len(measlog):
+        for table_name, marker, row_pattern in (('SA_SPAMEAS', r'Measurements for SA_SPAMEAS table', r'(\d+)\s+(\S+)\s+(\d+)\s+\d+'),
+                                                ('MS_PROCESS_MEAS', r'Measurements for MS_PROCESS_MEAS table', r'\d+\s+(\d+-\d+-\d+)\s+(\S+)\s+(\d+\.\d+)'),
+                                                ('MS_PERF_MEAS', r'Control Computer Performance Measurements for MS_PERF_MEAS table', r'\d+\s+(\d+-\d+-\d+)\s+\d+\s+\d+\s+\d+\s+(\d+)')):
+            if re.search(marker, measlog[num]) is not None:
+                begin, end, report_time = get_block_info(num)
+                num = begin
+                while num < end:
+                    match_result = re.search(row_pattern, measlog[num])
+                    if match_result:
+                        tables[table_name].append((report_time, match_result.groups()))
+                    num += 1
+        num += 1
+
+    return tables
+
+
+def run_legacy_parser(path):
+    f = open(path, 'r')
+    try:
+        measlog = f.readlines()
+    finally:
+        f.close()
+    legacy_analyze_measlog(measlog)
+
+
+def run_streaming_parser(path):
+    f = open(path, 'r')
+    try:
+        for block in calcmeas.iter_measlog_blocks(f):
+            pass
+    finally:
+        f.close()
+
+
+def run_mapped_parser(path):
+    for block in calcmeas.iter_measlog_file_blocks(path):
+        pass
+
+
+def bench_parser(path, repeat = 3):
+    '''print the lines/sec of the parsers, the best of repeat runs is used.'''
+
+    f = open(path, 'r')
+    try:
+        line_num = sum([1 for line in f])
+    finally:
+        f.close()
+
+    print 'Measurement log file: ', path, '(%d lines, %.1f MB)' % (line_num, os.path.getsize(path) / 1048576.0)
+
+    results = []
+    for name, run_parser in (('legacy (readlines + re.search)', run_legacy_parser),
+                             ('streaming (precompiled patterns)', run_streaming_parser),
+                             ('memory-mapped block scanner', run_mapped_parser)):
+        best = None
+        for count in range(repeat):
+            start = time.time()
+            run_parser(path)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results.append(best)
+        print '%-34s %8.3f s  %12.0f lines/sec' % (name, best, line_num / best)
+
+    print 'speedup: streaming %.2fx, memory-mapped %.2fx' % (results[0] / results[1], results[0] / results[2])
+
+
+class NullWriter(object):
+    '''the stdout of calcmeas.py is dropped during the benchmark.'''
+
+    def write(self, data):
+        pass
+
+
+def run_stage(stage, *args):
+    '''run stage(*args) with the output dropped, return (elapsed seconds, result).'''
+
+    stdout = sys.stdout
+    sys.stdout = NullWriter()
+    try:
+        start = time.time()
+        result = stage(*args)
+        elapsed = time.time() - start
+    finally:
+        sys.stdout = stdout
+    return elapsed, result
+
+
+def parse_measlog(path, columnar):
+    if columnar:
+        calcmeas.meas_store = calcmeas.ColumnarMeasStore()
+    else:
+        calcmeas.meas_store = calcmeas.MeasStore()
+    calcmeas.analyze_measlog_files([path])
+
+
+def aggregate_reports():
+    '''calculate the report lists of main(), the same ones printed by render_reports().'''
+
+    return (calcmeas.calc_hosts_overall_cpu_report_list(calcmeas.report_host_ids),
+            calcmeas.calc_epay_kpi_list(),
+            calcmeas.calc_processes_cpu_report_lists(calcmeas.report_processes))
+
+
+def render_reports(report_lists):
+    hosts_overall_cpu_reports_list, epay_kpi_list, process_cpu_report_lists = report_lists
+    calcmeas.print_hosts_overall_cpu_report(hosts_overall_cpu_reports_list, calcmeas.report_host_ids)
+    calcmeas.print_epay_kpi_report(epay_kpi_list)
+    for (process_name, process_type), process_cpu_report_list in zip(calcmeas.report_processes, process_cpu_report_lists):
+        calcmeas.print_process_cpu_report(process_cpu_report_list, process_name)
+
+
+def bench_stages(path, repeat = 3, columnar = False):
+    '''print the time of parse, aggregation and rendering of the reports of calcmeas.py, the best of repeat runs
+    is used for each stage. the peak memory is the one of this process after the stage.
+    '''
+
+    line_num = 0
+    f = open(path, 'r')
+    try:
+        for line in f:
+            line_num += 1
+    finally:
+        f.close()
+    size = os.path.getsize(path) / 1048576.0
+
+    print 'Measurement log file: ', path, '(%d lines, %.1f MB)' % (line_num, size)
+    print 'Measurement store:    ', columnar and 'ColumnarMeasStore' or 'MeasStore'
+
+    best = {}
+    peak = {}
+    for count in range(repeat):
+        for stage, run in (('parse', lambda: run_stage(parse_measlog, path, columnar)),
+                           ('aggregation', lambda: run_stage(aggregate_reports)),
+                           ('rendering', lambda: run_stage(render_reports, report_lists))):
+            elapsed, result = run()
+            if stage == 'aggregation':
+                report_lists = result
+            if stage not in best or elapsed < best[stage]:
+                best[stage] = elapsed
+            peak[stage] = calcmeas.get_peak_rss()
+
+    table_row_num = sum(calcmeas.meas_store.get_row_counts().values())
+    report_row_num = 0
+    for report_list in report_lists[:2] + tuple(report_lists[2]):
+        report_row_num += len(report_list)
+
+    for stage, throughput in (('parse', '%12.0f lines/sec, %.1f MB/sec' % (line_num / best['parse'], size / best['parse'])),
+                              ('aggregation', '%12.0f table rows/sec' % (table_row_num / best['aggregation'])),
+                              ('rendering', '%12.0f report rows/sec' % (report_row_num / best['rendering']))):
+        if peak[stage] is None:
+            memory = 'n/a'
+        else:
+            memory = '%.1f MB' % peak[stage]
+        print '%-12s %8.3f s  %-36s peak memory so far %s' % (stage, best[stage], throughput, memory)
+    print '%-12s %8.3f s' % ('total', best['parse'] + best['aggregation'] + best['rendering'])
+
+
+def main():
+    parser = OptionParser(usage = 'Usage: measbench.py [options] [measlog file]')
+    parser.add_option('--mode', type = 'choice', choices = ['all', 'parser', 'stages'], default = 'all',
+                      help = 'parser: lines/sec of the parsers, stages: time of parse, aggregation and rendering, all: both')
+    parser.add_option('--intervals', type = 'int', default = 96,
+                      help = 'number of 15 minutes intervals in the synthetic measlog')
+    parser.add_option('--hosts', type = 'int', default = None,
+                      help = 'number of hosts in the synthetic measlog, the hosts of host_role_definition come first')
+    parser.add_option('--processes', type = 'int', default = None,
+                      help = 'number of processes on each host in the synthetic measlog')
+    parser.add_option('--noise', type = 'int', default = 4,
+                      help = 'number of blocks of other tables before each interested table')
+    parser.add_option('--repeat', type = 'int', default = 3,
+                      help = 'number of runs of each parser or stage, the best one is reported')
+    parser.add_option('--columnar', action = 'store_true', default = False,
+                      help = 'use the columnar measurement store in the stages benchmark')
+    options, args = parser.parse_args()
+
+    def bench(path):
+        if options.mode in ('all', 'parser'):
+            bench_parser(path, options.repeat)
+        if options.mode == 'all':
+            print
+        if options.mode in ('all', 'stages'):
+            bench_stages(path, options.repeat, options.columnar)
+
+    # benchmark on the given measlog or on a synthetic one
+    if args:
+        bench(args[0])
+        return
+
+    fd, path = tempfile.mkstemp(prefix = 'measbench_', suffix = '.log')
+    try:
+        f = os.fdopen(fd, 'w')
+        try:
+            write_synthetic_measlog(f, options.intervals, options.noise, host_num = options.hosts, process_num = options.processes)
+        finally:
+            f.close()
+        bench(path)
+    finally:
+        os.remove(path)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+
+'''
+Collection service of calcmeas.py, it receives the measlogs of many sites and keeps their reports up to date.
+
+The measlogs are received from:
+1. TCP or unix socket streams, a stream may begin with a 'SITE <site name>' line, otherwise the site is named
+   by the address of the sender, e.g. (echo SITE paris; tail -F measlog) | nc <host> <port>
+2. the files in a spool directory, the site is the part of the file name before the first '.', e.g.
+   paris.20160307.log. the files are read as they grow, the compressed files are read once. when a file is
+   truncated, the measurements of its site are dropped and the spool files of the site are read again.
+The reports of each site are queried by HTTP GET, the result is JSON:
+    /sites                          the sites, number of blocks and rows, last report time
+    /sites/<site>/hosts             hosts overall CPU usage report
+    /sites/<site>/epay              EPAY KPI report
+    /sites/<site>/process           process CPU usage reports, by process name
+    ?last=N                         only the last N report times
+
+All the sites are served by one process with the select() loop of asyncore, python 2 has no asyncio.
+'''
+
+import os
+import time
+import calendar
+import socket
+import asyncore
+import json
+from urlparse import urlparse, parse_qs
+from optparse import OptionParser
+
+import calcmeas
+
+
+class MeasSite(object):
+    '''this class keeps the measurements of a site in a MeasStore, the ones older than keep_hours before the
+    last report time are dropped.
+    '''
+
+    def __init__(self, name, keep_hours = 24):
+        self.name = name
+        self.keep_hours = keep_hours
+        self.store = calcmeas.MeasStore()
+        self.block_num = 0
+        self.row_num = 0
+        self.last_report_time = None
+        self.streams = 0
+
+    def save_block(self, block):
+        table_name, report_time, rows = block
+        self.store.add_block(table_name, report_time, rows)
+        self.block_num += 1
+        self.row_num += len(rows)
+
+        # drop the old measurements when a new report time comes
+        if self.last_report_time is None or report_time > self.last_report_time:
+            self.last_report_time = report_time
+            if self.keep_hours:
+                try:
+                    last_time = calendar.timegm(time.strptime(report_time, '%Y-%m-%d %H:%M'))
+                except ValueError:
+                    return
+                self.store.drop_before(time.strftime('%Y-%m-%d %H:%M', time.gmtime(last_time - self.keep_hours * 3600)))
+
+    def reset(self):
+        '''drop all the measurements of the site, used when a spool file of the site is truncated and read again.'''
+
+        self.store = self.store.__class__()
+        self.block_num = 0
+        self.row_num = 0
+        self.last_report_time = None
+
+    def get_summary(self):
+        return {'site' : self.name, 'blocks' : self.block_num, 'rows' : self.row_num,
+                'last_report_time' : self.last_report_time, 'streams' : self.streams}
+
+    def calc_report(self, report_name, last = None):
+        '''calculate the report of this site by the functions of calcmeas.py, only the last report times are
+        calculated if last is given. return None for an unknown report.
+        '''
+
+        # the report functions of calcmeas.py work on its meas_store, the loop is single threaded
+        saved_store = calcmeas.meas_store
+        calcmeas.meas_store = self.store
+        try:
+            report_times = None
+            if last is not None:
+                if report_name == 'hosts':
+                    report_times = self.store.get_perf_report_times()[-last:]
+                else:
+                    report_times = self.store.get_process_report_times()[-last:]
+
+            if report_name == 'hosts':
+                return calcmeas.calc_hosts_overall_cpu_report_list(calcmeas.report_host_ids, report_times)
+            elif report_name == 'epay':
+                return calcmeas.calc_epay_kpi_list(report_times)
+            elif report_name == 'process':
+                process_cpu_report_lists = calcmeas.calc_processes_cpu_report_lists(calcmeas.report_processes, report_times)
+                return dict(zip([process_name for process_name, process_type in calcmeas.report_processes], process_cpu_report_lists))
+            return None
+        finally:
+            calcmeas.meas_store = saved_store
+
+
+class MeasService(object):
+    '''this class keeps the sites, they are created when their first measlog is received.'''
+
+    def __init__(self, keep_hours = 24):
+        self.keep_hours = keep_hours
+        self.sites = {}
+
+    def get_site(self, name):
+        if name not in self.sites:
+            print 'New site:', name
+            self.sites[name] = MeasSite(name, self.keep_hours)
+        return self.sites[name]
+
+
+class MeasStreamHandler(asyncore.dispatcher):
+    '''this class receives a measlog stream, the complete lines are parsed as soon as they are received.'''
+
+    def __init__(self, sock, service, default_site_name):
+        asyncore.dispatcher.__init__(self, sock)
+        self.service = service
+        self.default_site_name = default_site_name
+        self.site = None
+        self.parser = calcmeas.MeasBlockParser()
+        self.pending = ''
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        data = self.recv(65536)
+        if not data:
+            return
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.feed_line(line + '\n')
+
+    def feed_line(self, line):
+        if self.site is None:
+            if line.startswith('SITE '):
+                self.open_site(line[5:].strip() or self.default_site_name)
+                return
+            self.open_site(self.default_site_name)
+
+        block = self.parser.feed_line(line)
+        if block is not None:
+            self.site.save_block(block)
+
+    def open_site(self, name):
+        self.site = self.service.get_site(name)
+        self.site.streams += 1
+        print 'Site %s: stream opened' % name
+
+    def handle_close(self):
+        # the last line may have no line break, e.g. the '++-' of the last block
+        if self.pending:
+            self.feed_line(self.pending)
+            self.pending = ''
+        if self.site is not None:
+            self.site.streams -= 1
+            print 'Site %s: stream closed' % self.site.name
+        self.close()
+
+
+class MeasStreamServer(asyncore.dispatcher):
+    '''this class accepts the measlog streams on a TCP address (host, port) or a unix socket path.'''
+
+    def __init__(self, service, address):
+        asyncore.dispatcher.__init__(self)
+        self.service = service
+        if isinstance(address, tuple):
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+        else:
+            if os.path.exists(address):
+                os.remove(address)
+            self.create_socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.bind(address)
+        self.listen(64)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        sock, address = pair
+
+        # the stream without 'SITE' line is named by the address of the sender
+        if isinstance(address, tuple):
+            default_site_name = address[0]
+        else:
+            default_site_name = 'local'
+        MeasStreamHandler(sock, self.service, default_site_name)
+
+
+class MeasQueryHandler(asyncore.dispatcher):
+    '''this class answers one HTTP GET request with the JSON of the sites or a report, then closes.'''
+
+    def __init__(self, sock, service):
+        asyncore.dispatcher.__init__(self, sock)
+        self.service = service
+        self.request = ''
+        self.response = ''
+
+    def readable(self):
+        return not self.response
+
+    def writable(self):
+        return bool(self.response)
+
+    def handle_read(self):
+        self.request += self.recv(8192)
+        if '\r\n\r\n' in self.request or '\n\n' in self.request or len(self.request) > 65536:
+            self.response = self.get_response(self.request.split('\n', 1)[0].strip())
+
+    def handle_write(self):
+        sent = self.send(self.response)
+        self.response = self.response[sent:]
+        if not self.response:
+            self.close()
+
+    def handle_close(self):
+        self.close()
+
+    def get_response(self, request_line):
+        words = request_line.split()
+        if len(words) < 2 or words[0] != 'GET':
+            return self.format_response('405 Method Not Allowed', {'error' : 'only GET is supported'})
+
+        url = urlparse(words[1])
+        path = [word for word in url.path.split('/') if word]
+        query = parse_qs(url.query)
+
+        last = None
+        if 'last' in query:
+            try:
+                last = max(1, int(query['last'][0]))
+            except ValueError:
+                return self.format_response('400 Bad Request', {'error' : 'last should be a number'})
+
+        if path == ['sites']:
+            sites = [self.service.sites[name].get_summary() for name in sorted(self.service.sites.keys())]
+            return self.format_response('200 OK', sites)
+
+        if len(path) == 3 and path[0] == 'sites' and path[1] in self.service.sites:
+            report = self.service.sites[path[1]].calc_report(path[2], last)
+            if report is not None:
+                return self.format_response('200 OK', report)
+
+        return self.format_response('404 Not Found', {'error' : 'unknown path %s' % url.path})
+
+    def format_response(self, status, result):
+        body = json.dumps(result) + '\n'
+        return 'HTTP/1.0 %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n%s' % (status, len(body), body)
+
+
+class MeasQueryServer(asyncore.dispatcher):
+
+    def __init__(self, service, address):
+        asyncore.dispatcher.__init__(self)
+        self.service = service
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(address)
+        self.listen(16)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            MeasQueryHandler(pair[0], self.service)
+
+
+class MeasSpoolWatcher(object):
+    '''this class reads the measlog files in the spool directory as they grow, see the module description.
+    each file keeps its own parser and the offset after the last complete line, the compressed file keeps the
+    generator of its blocks until it is read.
+    at most read_size bytes of each file, or block_num blocks of a compressed file, are read by a poll, so the
+    streams and the queries are served while a large file is read.
+    '''
+
+    read_size = 256 * 1024
+    block_num = 250
+
+    def __init__(self, service, directory):
+        self.service = service
+        self.directory = directory
+        self.files = {}     # path -> [offset, parser, blocks], blocks is None for the file not compressed
+
+    def poll(self):
+        '''read the files for a while, return True if some of them are not read to their end.'''
+
+        busy = False
+        for file_name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, file_name)
+            if file_name.startswith('.') or not os.path.isfile(path):
+                continue
+            site_name = file_name.split('.', 1)[0]
+            site = self.service.get_site(site_name)
+
+            if path not in self.files:
+                if calcmeas.get_measlog_compression(path) is not None:
+                    self.files[path] = [os.path.getsize(path), None, calcmeas.iter_measlog_file_blocks(path)]
+                else:
+                    self.files[path] = [0, calcmeas.MeasBlockParser(), None]
+
+            offset, parser, blocks = self.files[path]
+            if parser is None:
+                if blocks is not None:
+                    if self.read_blocks(blocks, site):
+                        busy = True
+                    else:
+                        self.files[path][2] = None
+                continue
+
+            # the file is rotated or truncated, the measurements of the site are dropped and its files are read again
+            if os.path.getsize(path) < offset:
+                print 'Site %s: %s is truncated, read the files of the site again' % (site_name, path)
+                site.reset()
+                for item_path in self.files.keys():
+                    if os.path.basename(item_path).split('.', 1)[0] == site_name:
+                        del self.files[item_path]
+                busy = True
+                continue
+
+            self.files[path][0] = self.read_lines(path, offset, parser, site)
+            if self.files[path][0] - offset >= self.read_size:
+                busy = True
+
+        return busy
+
+    def read_blocks(self, blocks, site):
+        '''save at most block_num blocks of the generator, return False when it is finished.'''
+
+        for count in xrange(self.block_num):
+            try:
+                block = blocks.next()
+            except StopIteration:
+                return False
+            site.save_block(block)
+        return True
+
+    def read_lines(self, path, offset, parser, site):
+        '''parse the complete lines after offset, at most about read_size bytes of them, return the offset
+        after the last one.
+        '''
+
+        f = open(path, 'rb')
+        try:
+            f.seek(offset)
+            end = offset + self.read_size
+            while offset < end:
+                line = f.readline()
+
+                # stop at the line still being written
+                if not line.endswith('\n'):
+                    break
+                offset += len(line)
+
+                block = parser.feed_line(line)
+                if block is not None:
+                    site.save_block(block)
+        finally:
+            f.close()
+
+        return offset
+
+
+def parse_address(value):
+    '''convert 'host:port' or 'port' into (host, port).'''
+
+    if ':' in value:
+        host, port = value.rsplit(':', 1)
+    else:
+        host, port = '', value
+    return (host, int(port))
+
+
+def main():
+    parser = OptionParser(usage = 'Usage: measservice.py [options]')
+    parser.add_option('--listen', action = 'append', metavar = '[HOST:]PORT',
+                      help = 'receive the measlog streams on the TCP address, may be repeated')
+    parser.add_option('--unix', action = 'append', metavar = 'PATH',
+                      help = 'receive the measlog streams on the unix socket, may be repeated')
+    parser.add_option('--spool', action = 'append', metavar = 'DIR',
+                      help = 'read the measlog files in the directory, may be repeated')
+    parser.add_option('--interval', type = 'float', default = 5,
+                      help = 'seconds between two checks of the spool directories')
+    parser.add_option('--query', metavar = '[HOST:]PORT', default = '127.0.0.1:8080',
+                      help = 'answer the HTTP queries of the reports on the TCP address, default 127.0.0.1:8080')
+    parser.add_option('--keep-hours', type = 'int', default = 24,
+                      help = 'hours of measurements kept for each site, 0 keeps all of them')
+    parser.add_option('--topology', metavar = 'FILE',
+                      help = 'load the roles of the hosts from the [roles] section of FILE, see calcmeas.py')
+    options, args = parser.parse_args()
+
+    if options.topology:
+        try:
+            calcmeas.load_host_topology(options.topology)
+        except ValueError, e:
+            print 'Error:', e
+            return
+
+    if not (options.listen or options.unix or options.spool):
+        print 'Error: at least one of --listen, --unix and --spool should be given.'
+        parser.print_usage()
+        return
+
+    service = MeasService(options.keep_hours)
+    for value in options.listen or ():
+        MeasStreamServer(service, parse_address(value))
+        print 'Listening for measlog streams on', value
+    for path in options.unix or ():
+        MeasStreamServer(service, path)
+        print 'Listening for measlog streams on', path
+    watchers = []
+    for directory in options.spool or ():
+        watchers.append(MeasSpoolWatcher(service, directory))
+        print 'Watching spool directory', directory
+    MeasQueryServer(service, parse_address(options.query))
+    print 'Answering queries on', options.query
+
+    try:
+        next_poll = 0
+        busy = False
+        while True:
+            if watchers and time.time() >= next_poll:
+                busy = False
+                for watcher in watchers:
+                    if watcher.poll():
+                        busy = True
+
+                # the files not read to their end are read again right after the pending sockets are served
+                if busy:
+                    next_poll = 0
+                else:
+                    next_poll = time.time() + options.interval
+            if busy:
+                asyncore.loop(timeout = 0, count = 1)
+            else:
+                asyncore.loop(timeout = 1, count = 1)
+    except KeyboardInterrupt:
+        print '\nFinished!'
+    finally:
+        for path in options.unix or ():
+            if os.path.exists(path):
+                os.remove(path)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
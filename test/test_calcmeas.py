@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+
+'''
+Regression tests of calcmeas.py, run from the top directory with: python -m unittest discover -s test
+'''
+
+import os
+import sys
+import bz2
+import gzip
+import shutil
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import calcmeas
+import measbench
+
+
+measlog_blocks = '''+++ FE01 2016-03-07 00:00:05 MEAS #000001 >
+REPT MEAS
+    SPA Measurements for SA_SPAMEAS table
+  INTERVAL SPA CALLS ERR
+  900  EPAY28I  27611  0
+++-
+
++++ FE01 2016-03-07 00:00:05 MEAS #000002 >
+REPT MEAS
+    Process Measurements for MS_PROCESS_MEAS table
+  299  0-0-1   EPAY28I_1   39.10
+  299  0-0-9   MHRPROC   1.53
+++-
+
++++ FE01 2016-03-07 00:15:05 MEAS #000003 >
+REPT MEAS
+    Control Computer Performance Measurements for MS_PERF_MEAS table
+          299  0-0-2              1             0              0          98
+++-
+'''
+
+
+def get_parser_blocks(measlog):
+    return list(calcmeas.iter_measlog_blocks(measlog.splitlines(True)))
+
+
+def get_scanner_blocks(measlog):
+    return list(calcmeas.iter_mapped_measlog_blocks(measlog))
+
+
+class MappedMeasBlockScannerTest(unittest.TestCase):
+    '''the memory-mapped scanner yields the same blocks as MeasBlockParser.'''
+
+    def check_same_blocks(self, measlog, block_num):
+        blocks = get_parser_blocks(measlog)
+        self.assertEqual(len(blocks), block_num)
+        self.assertEqual(get_scanner_blocks(measlog), blocks)
+
+    def test_blocks(self):
+        self.check_same_blocks(measlog_blocks, 3)
+
+    def test_banner_before_blocks(self):
+        # '++-' after '+++' on the same line does not close a block
+        self.check_same_blocks('+++++-----\n' + measlog_blocks, 3)
+
+    def test_banner_between_blocks(self):
+        blocks = measlog_blocks.split('\n\n')
+        self.check_same_blocks('\n+++++-----\n'.join(blocks), 3)
+
+    def test_banner_at_end(self):
+        self.check_same_blocks(measlog_blocks + '+++++-----', 3)
+        self.check_same_blocks(measlog_blocks + '+++++-----\n', 3)
+
+    def test_block_without_trailer(self):
+        self.check_same_blocks(measlog_blocks + '+++ FE01 2016-03-07 00:30:05 MEAS #000004 >\nREPT MEAS\n', 3)
+
+    def test_report_time_error(self):
+        # the header line without report time is reported only for the blocks of the interested tables
+        block_without_time = '+++ FE01 MEAS #000004 >\n    Control Computer Performance Measurements for MS_PERF_MEAS table\n++-\n'
+        for measlog, error_num in (('+++++-----\n' + measlog_blocks, 0),
+                                   ('+++ FE01 MEAS #000004 >\n    Measurements for XX_OTHER table\n++-\n', 0),
+                                   (block_without_time, 1)):
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                blocks = get_parser_blocks(measlog)
+                output = sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+            self.assertEqual(output.count('Failed to get report time'), error_num)
+        self.assertEqual(blocks[0][1], calcmeas.unknown_report_time)
+
+
+def get_synthetic_measlog(intervals = 4, seed = 0):
+    buf = StringIO()
+    measbench.write_synthetic_measlog(buf, intervals, 2, seed)
+    return buf.getvalue()
+
+
+def get_store_data(store):
+    '''return the measurements of the store, comparable between the stores.'''
+
+    return (sorted(store.get_spa_meas()), sorted(store.iter_process_meas()), sorted(store.iter_perf_meas()))
+
+
+class MeasTestCase(unittest.TestCase):
+    '''a temporary directory for the files of the test, and the output of calcmeas.py is dropped.'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.meas_store = calcmeas.meas_store
+
+    def tearDown(self):
+        calcmeas.meas_store = self.meas_store
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.directory, name)
+        f = open(path, 'wb')
+        f.write(data)
+        f.close()
+        return path
+
+    def analyze(self, paths, *args, **kwargs):
+        '''analyze the measlog files into a new MeasStore and return it.'''
+
+        calcmeas.meas_store = calcmeas.MeasStore()
+        calcmeas.analyze_measlog_files(paths, *args, **kwargs)
+        return calcmeas.meas_store
+
+
+class SplitMeaslogTest(MeasTestCase):
+    '''the measlog files parsed in chunks by the worker processes give the same blocks as the serial parse.'''
+
+    def test_chunks(self):
+        measlog = '+++++-----\n' + get_synthetic_measlog()
+        path = self.write_file('m.log', measlog)
+        blocks = list(calcmeas.iter_measlog_blocks(measlog.splitlines(True)))
+        for chunk_size in (1, 100, 4096, len(measlog), len(measlog) * 2):
+            chunks = calcmeas.split_measlog(path, chunk_size)
+            self.assertEqual(chunks[0][1], 0)
+            self.assertEqual(chunks[-1][2], len(measlog))
+            chunk_blocks = []
+            for chunk in chunks:
+                chunk_blocks.extend(calcmeas.parse_measlog_chunk(chunk + (None,)))
+            self.assertEqual(chunk_blocks, blocks)
+
+    def test_jobs_with_pipe(self):
+        # the pipe has no chunks, it is parsed by this process between the chunks of the regular files
+        if not os.path.isdir('/dev/fd'):
+            return
+        first, second = get_synthetic_measlog(seed = 1), get_synthetic_measlog(seed = 2)
+        first_path = self.write_file('first.log', first)
+        second_path = self.write_file('second.log', second)
+        expected = get_store_data(self.analyze([first_path, second_path, first_path]))
+
+        read_fd, write_fd = os.pipe()
+        def write_pipe():
+            os.write(write_fd, second)
+            os.close(write_fd)
+        thread = threading.Thread(target = write_pipe)
+        thread.start()
+        try:
+            store = self.analyze([first_path, '/dev/fd/%d' % read_fd, first_path], 2, 1)
+        finally:
+            thread.join()
+            os.close(read_fd)
+        self.assertEqual(get_store_data(store), expected)
+
+
+class MeasStoreTest(unittest.TestCase):
+    '''MeasStore and ColumnarMeasStore keep the same measurements.'''
+
+    def get_store(self, store_class):
+        store = store_class()
+        for block in calcmeas.iter_mapped_measlog_blocks(measlog_blocks):
+            store.add_block(*block)
+        return store
+
+    def test_drop_before(self):
+        for store_class in (calcmeas.MeasStore, calcmeas.ColumnarMeasStore):
+            store = self.get_store(store_class)
+            store.drop_before('2016-03-07 00:15')
+            self.assertEqual(store.get_row_counts(), {'SA_SPAMEAS' : 0, 'MS_PROCESS_MEAS' : 0, 'MS_PERF_MEAS' : 1})
+            self.assertEqual(store.get_spa_meas(), [])
+            self.assertEqual(store.get_process_report_times(), [])
+            self.assertEqual(store.get_perf_report_times(), ['2016-03-07 00:15'])
+
+
+class WarehouseTest(MeasTestCase):
+    '''the warehouse keeps one row per measurement, and its reports are the ones of MeasStore.'''
+
+    def calc_reports(self, store, meas_filter = None):
+        calcmeas.meas_store = store
+        return (calcmeas.calc_hosts_overall_cpu_report_list(calcmeas.get_report_host_ids(meas_filter)),
+                calcmeas.calc_epay_kpi_list(),
+                calcmeas.calc_processes_cpu_report_lists(calcmeas.report_processes))
+
+    def assert_almost_equal_reports(self, first, second):
+        '''the sums of SQLite may differ from MeasStore in the last digit.'''
+
+        if isinstance(first, float) or isinstance(second, float):
+            self.assertAlmostEqual(first, second, 6)
+        elif isinstance(first, dict):
+            self.assertEqual(sorted(first.keys()), sorted(second.keys()))
+            for key in first:
+                self.assert_almost_equal_reports(first[key], second[key])
+        elif isinstance(first, (list, tuple)):
+            self.assertEqual(len(first), len(second))
+            for first_item, second_item in zip(first, second):
+                self.assert_almost_equal_reports(first_item, second_item)
+        else:
+            self.assertEqual(first, second)
+
+    def test_load_twice(self):
+        path = self.write_file('m.log', get_synthetic_measlog())
+        warehouse = os.path.join(self.directory, 'meas.db')
+        store = self.analyze([path])
+        row_num = sum(store.get_row_counts().values())
+        for load_num in range(2):
+            self.assertEqual(calcmeas.save_warehouse(warehouse, self.analyze([path])), row_num)
+            self.assertEqual(calcmeas.WarehouseMeasStore(warehouse).get_row_counts(), store.get_row_counts())
+
+    def test_reports(self):
+        path = self.write_file('m.log', get_synthetic_measlog())
+        warehouse = os.path.join(self.directory, 'meas.db')
+        calcmeas.save_warehouse(warehouse, self.analyze([path]))
+        for meas_filter in (None,
+                            calcmeas.MeasFilter(time_from = '2016-03-07 00:15', time_to = '2016-03-07 00:30'),
+                            calcmeas.MeasFilter(host_ids = ['0-0-1'], roles = ['db1', 'app'])):
+            reports = self.calc_reports(self.analyze([path], meas_filter = meas_filter), meas_filter)
+            self.assertTrue(reports[1])
+            self.assert_almost_equal_reports(self.calc_reports(calcmeas.WarehouseMeasStore(warehouse, meas_filter), meas_filter),
+                                             reports)
+
+
+class ReportExportTest(MeasTestCase):
+    '''the exported reports keep the values of each interval, --window changes only the tables.'''
+
+    def export(self, path, export_directory, window_size):
+        calcmeas.meas_store = calcmeas.MeasStore()
+        calcmeas.run_reports([path], window_size = window_size, export_directory = export_directory,
+                             export_formats = calcmeas.report_export_formats, table = False)
+        exports = {}
+        for file_name in os.listdir(export_directory):
+            f = open(os.path.join(export_directory, file_name), 'rb')
+            exports[file_name] = f.read()
+            f.close()
+        return exports
+
+    def test_window(self):
+        path = self.write_file('m.log', get_synthetic_measlog(intervals = 8))
+        exports = self.export(path, os.path.join(self.directory, 'intervals'), None)
+        self.assertEqual(len(exports), 3 * len(calcmeas.report_export_formats))
+        self.assertEqual(self.export(path, os.path.join(self.directory, 'rolling'), 4), exports)
+
+
+class MeaslogCacheTest(MeasTestCase):
+    '''the parsed cache is loaded while the measlog file is not changed, otherwise it is rebuilt.'''
+
+    def analyze_cached(self, path):
+        '''return the measurements analyzed with the parsed cache, and whether the cache is loaded.'''
+
+        sys.stdout = StringIO()
+        store = self.analyze([path], use_cache = True)
+        return get_store_data(store), 'Loaded parsed cache' in sys.stdout.getvalue()
+
+    def check_cache(self, path):
+        expected = get_store_data(self.analyze([path]))
+        self.assertEqual(self.analyze_cached(path), (expected, False))
+        self.assertTrue(os.path.isfile(path + calcmeas.measlog_cache_suffix))
+        self.assertFalse(os.path.exists(path + calcmeas.measlog_cache_suffix + '.tmp'))
+        self.assertEqual(self.analyze_cached(path), (expected, True))
+
+    def test_cache_hit(self):
+        self.check_cache(self.write_file('m.log', get_synthetic_measlog()))
+
+    def test_name_not_utf8(self):
+        measlog = measlog_blocks.replace('EPAY28I_1', 'EPAY\xe9_1')
+        self.check_cache(self.write_file('m.log', measlog))
+
+    def test_rebuild(self):
+        first, second = get_synthetic_measlog(seed = 1), get_synthetic_measlog(seed = 2)
+        path = self.write_file('m.log', first)
+        self.check_cache(path)
+
+        # the size is changed
+        self.write_file('m.log', first + measlog_blocks)
+        self.check_cache(path)
+
+        # only the mtime is changed
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        self.check_cache(path)
+
+        # only the content is changed, the size and mtime are kept
+        stat = os.stat(path)
+        self.write_file('m.log', (second + first + measlog_blocks)[:stat.st_size])
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        self.check_cache(path)
+
+
+class HostTopologyTest(MeasTestCase):
+    '''the roles of the hosts are loaded from the [roles] section of a topology file.'''
+
+    def setUp(self):
+        MeasTestCase.setUp(self)
+        self.host_role_definition = calcmeas.host_role_definition
+        self.host_topology = calcmeas.host_topology
+
+    def tearDown(self):
+        calcmeas.host_role_definition = self.host_role_definition
+        calcmeas.host_topology = self.host_topology
+        MeasTestCase.tearDown(self)
+
+    def test_expand_host_ids(self):
+        host_ids = calcmeas.expand_host_ids('0-0..3-1..16')
+        self.assertEqual(len(host_ids), 64)
+        self.assertEqual(host_ids[:3], ['0-0-1', '0-0-2', '0-0-3'])
+        self.assertEqual(host_ids[-1], '0-3-16')
+        self.assertEqual(calcmeas.expand_host_ids('0-0-1, 0-0-9  0-1..2-2'), ['0-0-1', '0-0-9', '0-1-2', '0-2-2'])
+        for value in ('0-0-3..1', '0-0-a..3', '0-0-1..'):
+            self.assertRaises(ValueError, calcmeas.expand_host_ids, value)
+
+    def test_load(self):
+        path = self.write_file('topology.ini', '[roles]\npilot = 0-0-1, 0-0-9\ndb = 0-0..1-2..3\n')
+        calcmeas.load_host_topology(path)
+        self.assertEqual(calcmeas.host_role_definition, {'pilot' : ('0-0-1', '0-0-9'),
+                                                         'db' : ('0-0-2', '0-0-3', '0-1-2', '0-1-3')})
+        self.assertEqual(calcmeas.host_topology.get_role('0-1-3'), 'db')
+        self.assertEqual(calcmeas.host_topology.get_role('0-0-4'), None)
+        self.assertEqual(calcmeas.host_topology.get_role_code('0-0-4'), 0)
+        self.assertEqual(calcmeas.get_report_host_ids(calcmeas.MeasFilter(roles = ['db'])),
+                         ('0-0-2', '0-0-3', '0-1-2', '0-1-3'))
+        self.assertEqual(calcmeas.get_report_host_ids(calcmeas.MeasFilter(roles = ['app'])), ('0-0-10', '0-0-5'))
+
+    def test_host_with_two_roles(self):
+        path = self.write_file('topology.ini', '[roles]\npilot = 0-0-1, 0-0-9\ndb = 0-0-1..3\n')
+        self.assertRaises(ValueError, calcmeas.load_host_topology, path)
+        self.assertTrue(calcmeas.host_topology is self.host_topology)
+
+        # the same role given twice to a host is not an error
+        calcmeas.load_host_topology(self.write_file('topology.ini', '[roles]\ndb = 0-0-1, 0-0-1..3\n'))
+        self.assertEqual(calcmeas.host_topology.get_role('0-0-1'), 'db')
+
+    def test_reserved_app_role(self):
+        path = self.write_file('topology.ini', '[roles]\npilot = 0-0-1\napp = 0-0-5\n')
+        self.assertRaises(ValueError, calcmeas.load_host_topology, path)
+        self.assertTrue(calcmeas.host_topology is self.host_topology)
+
+    def test_wrong_files(self):
+        for name, content in (('no_roles.ini', '[hosts]\npilot = 0-0-1\n'), ('no_section.ini', 'pilot = 0-0-1\n')):
+            self.assertRaises(ValueError, calcmeas.load_host_topology, self.write_file(name, content))
+        self.assertRaises(ValueError, calcmeas.load_host_topology, os.path.join(self.directory, 'missing.ini'))
+        self.assertTrue(calcmeas.host_topology is self.host_topology)
+
+
+class MeasFilterTest(unittest.TestCase):
+    '''MeasFilter compares the report times by prefix, and the 'app' role is of the hosts without a role.'''
+
+    def test_time_prefix(self):
+        meas_filter = calcmeas.MeasFilter(time_to = '2016-03-07')
+        self.assertTrue(meas_filter.accept_time('2016-03-07 00:00'))
+        self.assertTrue(meas_filter.accept_time('2016-03-07 23:45'))
+        self.assertFalse(meas_filter.accept_time('2016-03-08 00:00'))
+
+        meas_filter = calcmeas.MeasFilter(time_from = '2016-03-07 12', time_to = '2016-03-07 12:30')
+        self.assertFalse(meas_filter.accept_time('2016-03-07 11:45'))
+        self.assertTrue(meas_filter.accept_time('2016-03-07 12:00'))
+        self.assertTrue(meas_filter.accept_time('2016-03-07 12:30'))
+        self.assertFalse(meas_filter.accept_time('2016-03-07 12:45'))
+
+    def test_time_window_blocks(self):
+        for time_from, time_to, report_times in ((None, '2016-03-07', ['2016-03-07 00:00', '2016-03-07 00:15']),
+                                                 ('2016-03-07 00:15', None, ['2016-03-07 00:15']),
+                                                 (None, '2016-03-06', [])):
+            blocks = calcmeas.iter_measlog_blocks(measlog_blocks.splitlines(True), calcmeas.MeasFilter(time_from, time_to))
+            self.assertEqual(sorted(set([report_time for table_name, report_time, rows in blocks])), report_times)
+
+    def test_app_role(self):
+        meas_filter = calcmeas.MeasFilter(roles = ['app'])
+        self.assertTrue(meas_filter.accept_host('0-0-5'))
+        self.assertFalse(meas_filter.accept_host('0-0-1'))
+        self.assertTrue(meas_filter.accept_row('SA_SPAMEAS', {}))
+        self.assertFalse(meas_filter.accept_row('MS_PERF_MEAS', {'host_id' : '0-0-2'}))
+
+        meas_filter = calcmeas.MeasFilter(host_ids = ['0-0-1'], roles = ['app'])
+        self.assertTrue(meas_filter.accept_host('0-0-1'))
+        self.assertTrue(meas_filter.accept_host('0-0-5'))
+        self.assertFalse(meas_filter.accept_host('0-0-9'))
+
+    def test_report_host_ids(self):
+        self.assertEqual(calcmeas.get_report_host_ids(calcmeas.MeasFilter(time_to = '2016-03-07')),
+                         calcmeas.report_host_ids)
+        self.assertEqual(calcmeas.get_report_host_ids(calcmeas.MeasFilter(roles = ['db2'])),
+                         ('0-0-3', '0-0-11', '0-1-2', '0-1-10', '0-1-3', '0-1-11'))
+        self.assertEqual(calcmeas.get_report_host_ids(calcmeas.MeasFilter(host_ids = ['0-0-7'], roles = ['pilot', 'app'])),
+                         ('0-0-1', '0-0-9', '0-0-5', '0-0-7'))
+
+
+def get_gzip_data(content):
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj = buf, mode = 'wb')
+    f.write(content)
+    f.close()
+    return buf.getvalue()
+
+
+class MeasDataTest(unittest.TestCase):
+    '''the compressed measlog files are decompressed by iter_measlog_data() at any read size.'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, name, data):
+        path = os.path.join(self.directory, name)
+        f = open(path, 'wb')
+        f.write(data)
+        f.close()
+        return path
+
+    def check_content(self, path, content):
+        for read_size in range(1, 40) + [1024 * 1024]:
+            self.assertEqual(''.join(calcmeas.iter_measlog_data(path, read_size)), content)
+
+    def test_gzip_streams_with_zero_padding(self):
+        # the padding begins at a read boundary for some of the read sizes
+        first, second = measlog_blocks[:100], measlog_blocks[100:]
+        data = get_gzip_data(first) + '\x00' * 5 + get_gzip_data(second) + '\x00' * 13
+        self.check_content(self.write_file('m.log.gz', data), measlog_blocks)
+
+    def test_bz2_streams_with_zero_padding(self):
+        data = bz2.compress(measlog_blocks[:100]) + '\x00' * 7 + bz2.compress(measlog_blocks[100:]) + '\x00' * 3
+        self.check_content(self.write_file('m.log.bz2', data), measlog_blocks)
+
+    def test_xz_without_lzma(self):
+        path = self.write_file('m.log.xz', '\xfd7zXZ\x00' + '\x00' * 32)
+        saved_modules = calcmeas.optional_modules.copy()
+        calcmeas.optional_modules[('lzma', 'backports.lzma')] = None
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.assertEqual(calcmeas.count_measlog_lines(path), (0, 0))
+            self.assertEqual(list(calcmeas.iter_measlog_file_blocks(path)), [])
+        finally:
+            sys.stdout = stdout
+            calcmeas.optional_modules.clear()
+            calcmeas.optional_modules.update(saved_modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+'''
+Tests of measservice.py with local sockets, run from the top directory with: python -m unittest discover -s test
+'''
+
+import os
+import sys
+import bz2
+import time
+import json
+import socket
+import shutil
+import asyncore
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import calcmeas
+import measbench
+import measservice
+
+
+def get_synthetic_measlog(intervals = 8, seed = 0):
+    buf = StringIO()
+    measbench.write_synthetic_measlog(buf, intervals, 2, seed)
+    return buf.getvalue()
+
+
+def calc_reports(measlog, last = None):
+    '''calculate the reports of the measlog by calcmeas.py directly, as they are returned by the queries.'''
+
+    store = calcmeas.MeasStore()
+    for block in calcmeas.iter_mapped_measlog_blocks(measlog):
+        store.add_block(*block)
+
+    saved_store = calcmeas.meas_store
+    calcmeas.meas_store = store
+    try:
+        process_report_times = perf_report_times = None
+        if last is not None:
+            process_report_times = store.get_process_report_times()[-last:]
+            perf_report_times = store.get_perf_report_times()[-last:]
+        process_cpu_report_lists = calcmeas.calc_processes_cpu_report_lists(calcmeas.report_processes, process_report_times)
+        reports = {'hosts' : calcmeas.calc_hosts_overall_cpu_report_list(calcmeas.report_host_ids, perf_report_times),
+                   'epay' : calcmeas.calc_epay_kpi_list(process_report_times),
+                   'process' : dict(zip([process_name for process_name, process_type in calcmeas.report_processes],
+                                        process_cpu_report_lists))}
+    finally:
+        calcmeas.meas_store = saved_store
+
+    # the same types as the JSON of the queries
+    return json.loads(json.dumps(reports))
+
+
+class MeasServiceTest(unittest.TestCase):
+    '''the measlogs are sent to a TCP and a unix socket, the reports are queried by HTTP and compared with the
+    ones calculated by calcmeas.py directly.
+    '''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+        self.service = measservice.MeasService(keep_hours = 0)
+        self.tcp_address = measservice.MeasStreamServer(self.service, ('127.0.0.1', 0)).socket.getsockname()
+        self.unix_address = os.path.join(self.directory, 'measlog.sock')
+        measservice.MeasStreamServer(self.service, self.unix_address)
+        self.query_address = measservice.MeasQueryServer(self.service, ('127.0.0.1', 0)).socket.getsockname()
+
+        self.running = True
+        self.thread = threading.Thread(target = self.loop)
+        self.thread.start()
+
+    def tearDown(self):
+        self.running = False
+        self.thread.join()
+        asyncore.close_all()
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def loop(self):
+        while self.running:
+            asyncore.loop(timeout = 0.05, count = 1)
+
+    def send_measlog(self, family, address, site_name, measlog):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+            sock.sendall('SITE %s\n' % site_name + measlog)
+        finally:
+            sock.close()
+
+    def query(self, path):
+        sock = socket.create_connection(self.query_address)
+        try:
+            sock.sendall('GET %s HTTP/1.0\r\n\r\n' % path)
+            response = ''
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                response += data
+        finally:
+            sock.close()
+
+        header, body = response.split('\r\n\r\n', 1)
+        self.assertTrue(header.startswith('HTTP/1.0 200 '), header)
+        return json.loads(body)
+
+    def wait_blocks(self, block_nums):
+        '''wait until the sites have received block_nums (site name -> number of blocks).'''
+
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            sites = dict([(site['site'], site['blocks']) for site in self.query('/sites')])
+            if sites == block_nums:
+                return
+            time.sleep(0.05)
+        self.fail('the sites have %s blocks, %s are expected' % (sites, block_nums))
+
+    def test_tcp_and_unix_streams(self):
+        measlogs = {'paris' : get_synthetic_measlog(seed = 1), 'lyon' : get_synthetic_measlog(seed = 2)}
+
+        # the last '++-' has no line break, it is parsed when the stream is closed
+        self.send_measlog(socket.AF_INET, self.tcp_address, 'paris', measlogs['paris'].rstrip('\n'))
+        self.send_measlog(socket.AF_UNIX, self.unix_address, 'lyon', measlogs['lyon'])
+
+        block_nums = {}
+        for site_name, measlog in measlogs.items():
+            block_nums[site_name] = len(list(calcmeas.iter_mapped_measlog_blocks(measlog)))
+        self.wait_blocks(block_nums)
+
+        for site_name, measlog in measlogs.items():
+            reports = calc_reports(measlog)
+            for report_name in ('hosts', 'epay', 'process'):
+                self.assertEqual(self.query('/sites/%s/%s' % (site_name, report_name)), reports[report_name])
+            reports = calc_reports(measlog, 2)
+            for report_name in ('hosts', 'epay', 'process'):
+                self.assertEqual(self.query('/sites/%s/%s?last=2' % (site_name, report_name)), reports[report_name])
+
+
+class MeasSpoolWatcherTest(unittest.TestCase):
+    '''the files of the spool directory are read a bounded amount at a time.'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+        self.service = measservice.MeasService(keep_hours = 0)
+        self.watcher = measservice.MeasSpoolWatcher(self.service, self.directory)
+        self.watcher.read_size = 4096
+        self.watcher.block_num = 5
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.directory)
+
+    def write_file(self, name, data):
+        f = open(os.path.join(self.directory, name), 'wb')
+        f.write(data)
+        f.close()
+
+    def poll_all(self):
+        poll_num = 1
+        while self.watcher.poll():
+            poll_num += 1
+        return poll_num
+
+    def check_site(self, site_name, measlog):
+        site = self.service.sites[site_name]
+        self.assertEqual(site.block_num, len(list(calcmeas.iter_mapped_measlog_blocks(measlog))))
+        saved_store = calcmeas.meas_store
+        calcmeas.meas_store = site.store
+        try:
+            self.assertEqual(json.loads(json.dumps(calcmeas.calc_epay_kpi_list())), calc_reports(measlog)['epay'])
+        finally:
+            calcmeas.meas_store = saved_store
+
+    def test_bounded_reads(self):
+        measlog = get_synthetic_measlog()
+        self.write_file('paris.log', measlog)
+        self.write_file('lyon.log.bz2', bz2.compress(measlog))
+        self.assertTrue(self.poll_all() > 2)
+        self.check_site('paris', measlog)
+        self.check_site('lyon', measlog)
+
+    def test_truncated_file(self):
+        measlog = get_synthetic_measlog()
+        self.write_file('paris.log', measlog)
+        self.poll_all()
+
+        # the file is truncated and written again, the rows are not counted twice
+        self.write_file('paris.log', measlog[:len(measlog) / 2])
+        self.poll_all()
+        self.write_file('paris.log', measlog)
+        self.poll_all()
+        self.check_site('paris', measlog)
+
+
+if __name__ == '__main__':
+    unittest.main()